@@ -1,94 +1,170 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-"""
-Модуль конфигурации Excel Mail Processor
-Загрузка и валидация переменных окружения
-"""
-
-import os
-from dotenv import load_dotenv
-from logger import get_logger
-
-logger = get_logger(__name__)
-
-class Config:
-    """Класс конфигурации системы"""
-
-    def __init__(self):
-        """Инициализация конфигурации"""
-        load_dotenv()
-        self._load_config()
-        self._validate_config()
-        logger.info("Конфигурация загружена и валидирована успешно")
-
-    def _load_config(self):
-        """Загрузка всех параметров конфигурации"""
-
-        # IMAP настройки
-        self.imap_server = os.getenv('IMAP_SERVER', 'mail.hosting.reg.ru')
-        self.imap_port = int(os.getenv('IMAP_PORT', '993'))
-        self.imap_user = os.getenv('IMAP_USER')
-        self.imap_password = os.getenv('IMAP_PASSWORD')
-        self.imap_use_ssl = os.getenv('IMAP_USE_SSL', 'true').lower() == 'true'
-
-        # SMTP настройки
-        self.smtp_server = os.getenv('SMTP_SERVER', 'mail.hosting.reg.ru')
-        self.smtp_port = int(os.getenv('SMTP_PORT', '465'))
-        self.smtp_user = os.getenv('SMTP_USER')
-        self.smtp_password = os.getenv('SMTP_PASSWORD')
-        self.smtp_use_ssl = os.getenv('SMTP_USE_SSL', 'true').lower() == 'true'
-        self.smtp_use_tls = os.getenv('SMTP_USE_TLS', 'false').lower() == 'true'
-
-        # OneDrive настройки
-        self.onedrive_instruction_url = os.getenv('ONEDRIVE_INSTRUCTION_URL')
-
-        # Email настройки
-        self.recipient_email = os.getenv('RECIPIENT_EMAIL')
-        self.sender_name = os.getenv('SENDER_NAME', 'Transfora Mail Processor')
-
-        # Дополнительные настройки
-        self.temp_dir = os.getenv('TEMP_DIR', '/tmp')
-        self.log_level = os.getenv('LOG_LEVEL', 'INFO')
-        self.max_file_size_mb = int(os.getenv('MAX_FILE_SIZE_MB', '10'))
-
-    def _validate_config(self):
-        """Валидация обязательных параметров"""
-        required_params = [
-            ('IMAP_USER', self.imap_user),
-            ('IMAP_PASSWORD', self.imap_password),
-            ('SMTP_USER', self.smtp_user),
-            ('SMTP_PASSWORD', self.smtp_password),
-            ('ONEDRIVE_INSTRUCTION_URL', self.onedrive_instruction_url),
-            ('RECIPIENT_EMAIL', self.recipient_email)
-        ]
-
-        missing_params = []
-        for param_name, param_value in required_params:
-            if not param_value:
-                missing_params.append(param_name)
-
-        if missing_params:
-            error_msg = f"Отсутствуют обязательные параметры в .env: {', '.join(missing_params)}"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-
-    def get_imap_config(self):
-        """Получение конфигурации IMAP"""
-        return {
-            'host': self.imap_server,
-            'port': self.imap_port,
-            'username': self.imap_user,
-            'password': self.imap_password,
-            'ssl': self.imap_use_ssl
-        }
-
-    def get_smtp_config(self):
-        """Получение конфигурации SMTP"""
-        return {
-            'host': self.smtp_server,
-            'port': self.smtp_port,
-            'username': self.smtp_user,
-            'password': self.smtp_password,
-            'ssl': self.smtp_use_ssl,
-            'tls': self.smtp_use_tls
-        }
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Модуль конфигурации Excel Mail Processor
+Загрузка и валидация переменных окружения
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from dotenv import load_dotenv
+from logger import get_logger
+
+# Запеченная конфигурация (генерируется bake_env.py из .env)
+# Если модуль есть, его .pyc обслуживает загрузку без парсинга .env
+try:
+    import env_config as _baked_env
+except ImportError:
+    _baked_env = None
+
+logger = get_logger(__name__)
+
+# Однократная загрузка .env на процесс (защита от повторного парсинга файла)
+_dotenv_lock = threading.Lock()
+_dotenv_loaded = False
+
+def _ensure_dotenv():
+    """Загрузка .env ровно один раз на процесс"""
+    global _dotenv_loaded
+    if _dotenv_loaded:
+        return
+    with _dotenv_lock:
+        if not _dotenv_loaded:
+            load_dotenv()
+            _dotenv_loaded = True
+
+@dataclass(frozen=True)
+class Config:
+    """Класс конфигурации системы (неизменяемый после создания)"""
+
+    # IMAP настройки
+    imap_server: str
+    imap_port: int
+    imap_user: str
+    imap_password: str
+    imap_use_ssl: bool
+
+    # SMTP настройки
+    smtp_server: str
+    smtp_port: int
+    smtp_user: str
+    smtp_password: str
+    smtp_use_ssl: bool
+    smtp_use_tls: bool
+
+    # OneDrive настройки
+    onedrive_instruction_url: str
+
+    # Email настройки
+    recipient_email: str
+    sender_name: str
+
+    # Дополнительные настройки
+    temp_dir: str
+    log_level: str
+    max_file_size_mb: int
+
+    def get_imap_config(self):
+        """Получение конфигурации IMAP"""
+        return {
+            'host': self.imap_server,
+            'port': self.imap_port,
+            'username': self.imap_user,
+            'password': self.imap_password,
+            'ssl': self.imap_use_ssl
+        }
+
+    def get_smtp_config(self):
+        """Получение конфигурации SMTP"""
+        return {
+            'host': self.smtp_server,
+            'port': self.smtp_port,
+            'username': self.smtp_user,
+            'password': self.smtp_password,
+            'ssl': self.smtp_use_ssl,
+            'tls': self.smtp_use_tls
+        }
+
+def _env_get(env, name, default=None):
+    """Значение параметра: сначала окружение, затем env_config.py
+
+    Тот же приоритет, что у load_dotenv (override=False): реальные
+    переменные окружения выигрывают у запеченных значений из .env
+    """
+    value = env.get(name)
+    if value is not None:
+        return value
+    if _baked_env is not None:
+        value = getattr(_baked_env, name, None)
+        if value is not None:
+            return value
+    return default
+
+def _load_config():
+    """Загрузка всех параметров конфигурации"""
+
+    # Один снимок окружения вместо ~20 обращений к os.environ
+    env = dict(os.environ)
+
+    return Config(
+        # IMAP настройки
+        imap_server=_env_get(env, 'IMAP_SERVER', 'mail.hosting.reg.ru'),
+        imap_port=int(_env_get(env, 'IMAP_PORT', '993')),
+        imap_user=_env_get(env, 'IMAP_USER'),
+        imap_password=_env_get(env, 'IMAP_PASSWORD'),
+        imap_use_ssl=_env_get(env, 'IMAP_USE_SSL', 'true').lower() == 'true',
+
+        # SMTP настройки
+        smtp_server=_env_get(env, 'SMTP_SERVER', 'mail.hosting.reg.ru'),
+        smtp_port=int(_env_get(env, 'SMTP_PORT', '465')),
+        smtp_user=_env_get(env, 'SMTP_USER'),
+        smtp_password=_env_get(env, 'SMTP_PASSWORD'),
+        smtp_use_ssl=_env_get(env, 'SMTP_USE_SSL', 'true').lower() == 'true',
+        smtp_use_tls=_env_get(env, 'SMTP_USE_TLS', 'false').lower() == 'true',
+
+        # OneDrive настройки
+        onedrive_instruction_url=_env_get(env, 'ONEDRIVE_INSTRUCTION_URL'),
+
+        # Email настройки
+        recipient_email=_env_get(env, 'RECIPIENT_EMAIL'),
+        sender_name=_env_get(env, 'SENDER_NAME', 'Transfora Mail Processor'),
+
+        # Дополнительные настройки
+        temp_dir=_env_get(env, 'TEMP_DIR', '/tmp'),
+        log_level=_env_get(env, 'LOG_LEVEL', 'INFO'),
+        max_file_size_mb=int(_env_get(env, 'MAX_FILE_SIZE_MB', '10'))
+    )
+
+def _validate_config(config):
+    """Валидация обязательных параметров"""
+    required_params = [
+        ('IMAP_USER', config.imap_user),
+        ('IMAP_PASSWORD', config.imap_password),
+        ('SMTP_USER', config.smtp_user),
+        ('SMTP_PASSWORD', config.smtp_password),
+        ('ONEDRIVE_INSTRUCTION_URL', config.onedrive_instruction_url),
+        ('RECIPIENT_EMAIL', config.recipient_email)
+    ]
+
+    missing_params = []
+    for param_name, param_value in required_params:
+        if not param_value:
+            missing_params.append(param_name)
+
+    if missing_params:
+        error_msg = f"Отсутствуют обязательные параметры в .env: {', '.join(missing_params)}"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+
+@lru_cache(maxsize=1)
+def get_config():
+    """Получение единственного экземпляра конфигурации на процесс"""
+    # При наличии запеченного env_config.py парсинг .env не нужен вовсе
+    if _baked_env is None:
+        _ensure_dotenv()
+    config = _load_config()
+    _validate_config(config)
+    logger.info("Конфигурация загружена и валидирована успешно")
+    return config
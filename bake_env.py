@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сборка env_config.py из .env
+Запекает переменные окружения в обычный Python модуль: при последующих
+запусках интерпретатор использует кэш байткода (.pyc) вместо парсинга
+.env на каждый старт процесса
+
+Использование: python3 bake_env.py
+"""
+
+import os
+from dotenv import dotenv_values
+
+def bake():
+    """Чтение .env и генерация env_config.py"""
+    values = dotenv_values()
+    if not values:
+        print("⚠️ Файл .env не найден или пуст, env_config.py не создан")
+        return
+
+    lines = [
+        '# -*- coding: utf-8 -*-',
+        '# Сгенерировано bake_env.py из .env — не редактировать вручную',
+        '# Файл содержит учетные данные, не добавлять в git',
+        ''
+    ]
+    for key, value in values.items():
+        lines.append(f"{key} = {value!r}")
+
+    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'env_config.py')
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    print(f"✅ Записано {len(values)} переменных в {output_path}")
+
+if __name__ == '__main__':
+    bake()
@@ -1,260 +1,546 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-"""
-Модуль работы с электронной почтой v8.0
-Получение писем и отправка результатов
-ИСПРАВЛЕНИЯ v8.0:
-- Поддержка настраиваемых email шаблонов из OneDrive
-- Расширенные переменные для подстановки
-- Улучшенное логирование отправки
-"""
-
-import smtplib
-import ssl
-import os
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-from datetime import datetime
-from imap_tools import MailBox, AND
-from logger import get_logger
-
-logger = get_logger(__name__)
-
-class EmailHandler:
-    """Обработчик электронной почты v8.0"""
-
-    def __init__(self, config):
-        """Инициализация обработчика"""
-        self.config = config
-
-    def test_imap_connection(self):
-        """Тестирование IMAP соединения"""
-        try:
-            with MailBox(self.config.imap_server, port=self.config.imap_port).login(
-                self.config.imap_user,
-                self.config.imap_password,
-                'INBOX'
-            ) as mailbox:
-                logger.info("IMAP соединение работает")
-                return True
-        except Exception as e:
-            logger.error(f"Ошибка IMAP соединения: {str(e)}")
-            return False
-
-    def test_smtp_connection(self):
-        """Тестирование SMTP соединения"""
-        try:
-            if self.config.smtp_port == 465:
-                context = ssl.create_default_context()
-                with smtplib.SMTP_SSL(self.config.smtp_server, self.config.smtp_port, context=context) as server:
-                    server.login(self.config.smtp_user, self.config.smtp_password)
-                    logger.info("SMTP соединение работает")
-                    return True
-            else:
-                with smtplib.SMTP(self.config.smtp_server, self.config.smtp_port) as server:
-                    server.starttls()
-                    server.login(self.config.smtp_user, self.config.smtp_password)
-                    logger.info("SMTP соединение работает")
-                    return True
-        except Exception as e:
-            logger.error(f"Ошибка SMTP соединения: {str(e)}")
-            return False
-
-    def get_unread_emails_with_excel(self):
-        """Получение непрочитанных писем с Excel вложениями"""
-        try:
-            emails_with_excel = []
-            with MailBox(self.config.imap_server, port=self.config.imap_port).login(
-                self.config.imap_user,
-                self.config.imap_password,
-                'INBOX'
-            ) as mailbox:
-                # Поиск непрочитанных писем
-                for msg in mailbox.fetch(AND(seen=False)):
-                    excel_attachments = []
-                    # Проверка вложений
-                    for attachment in msg.attachments:
-                        if attachment.filename and attachment.filename.lower().endswith(('.xlsx', '.xls')):
-                            file_size_mb = len(attachment.payload) / (1024 * 1024)
-                            if file_size_mb <= self.config.max_file_size_mb:
-                                excel_attachments.append({
-                                    'filename': attachment.filename,
-                                    'content': attachment.payload,
-                                    'size_mb': round(file_size_mb, 2)
-                                })
-                                logger.info(f"Найдено Excel вложение: {attachment.filename} ({file_size_mb:.2f} МБ)")
-                            else:
-                                logger.warning(f"Файл {attachment.filename} превышает максимальный размер ({file_size_mb:.2f} МБ)")
-
-                    if excel_attachments:
-                        emails_with_excel.append({
-                            'uid': msg.uid,
-                            'sender': msg.from_,
-                            'subject': msg.subject,
-                            'date': msg.date,
-                            'attachments': excel_attachments
-                        })
-                        logger.info(f"Письмо от {msg.from_} содержит {len(excel_attachments)} Excel файлов")
-
-            return emails_with_excel
-        except Exception as e:
-            logger.error(f"Ошибка при получении писем: {str(e)}")
-            return []
-
-    def send_processed_file_v8(self, file_path, original_filename, sender_email, email_template=None, processing_stats=None):
-        """
-        Отправка обработанного файла v8.0 с поддержкой настраиваемых шаблонов
-        """
-        try:
-            # Подготовка данных для шаблона v8.0
-            now = datetime.now()
-            
-            # Расширенный набор переменных для v8.0
-            template_data = {
-                'source_filename': original_filename,
-                'output_filename': os.path.basename(file_path),
-                'sender_email': sender_email,
-                'processing_date': now.strftime("%Y-%m-%d %H:%M:%S"),
-                'processing_date_short': now.strftime("%Y-%m-%d"),
-                'processing_time': now.strftime("%H:%M"),
-                'processed_rows': processing_stats.get('processed_rows', 0) if processing_stats else 0,
-                'applied_rules': processing_stats.get('applied_rules', 0) if processing_stats else 0,
-                'created_columns': processing_stats.get('created_columns', 0) if processing_stats else 0,
-                'custom_content': self._get_custom_content(processing_stats),
-                'footer_text': self._get_footer_text(email_template)
-            }
-
-            # Формирование темы и текста письма v8.0
-            if email_template and 'body_template' in email_template:
-                # Новый подход v8.0: полный шаблон из OneDrive
-                subject = email_template.get('subject', 'Обработанный файл: {output_filename}').format(**template_data)
-                body = email_template['body_template'].format(**template_data)
-                logger.info("✅ Используется настраиваемый шаблон письма v8.0 из OneDrive")
-            elif email_template:
-                # Совместимость с v6.0
-                subject = email_template.get('subject', 'Обработанный файл: {output_filename}').format(**template_data)
-                body = self._build_legacy_email_body(email_template, template_data)
-                logger.info("📧 Используется совместимый шаблон письма v6.0")
-            else:
-                # Стандартный шаблон
-                subject = f"Обработанный файл: {os.path.basename(file_path)}"
-                body = self._get_default_email_body_v8().format(**template_data)
-                logger.info("📧 Используется стандартный шаблон письма")
-
-            # Создание сообщения
-            msg = MIMEMultipart()
-            msg['From'] = f"{self.config.sender_name} <{self.config.smtp_user}>"
-            msg['To'] = self.config.recipient_email
-            msg['Subject'] = subject
-
-            # Добавление текста
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-
-            # Добавление вложения
-            with open(file_path, 'rb') as f:
-                attachment = MIMEApplication(f.read(), _subtype='xlsx')
-                attachment.add_header(
-                    'Content-Disposition',
-                    'attachment',
-                    filename=os.path.basename(file_path)
-                )
-                msg.attach(attachment)
-
-            # Отправка письма
-            if self.config.smtp_port == 465:
-                context = ssl.create_default_context()
-                with smtplib.SMTP_SSL(self.config.smtp_server, self.config.smtp_port, context=context) as server:
-                    server.login(self.config.smtp_user, self.config.smtp_password)
-                    server.send_message(msg)
-            else:
-                with smtplib.SMTP(self.config.smtp_server, self.config.smtp_port) as server:
-                    server.starttls()
-                    server.login(self.config.smtp_user, self.config.smtp_password)
-                    server.send_message(msg)
-
-            logger.info(f"✅ Email отправлен успешно на {self.config.recipient_email}")
-            logger.info(f"📧 Тема: {subject}")
-            logger.info(f"📎 Вложение: {os.path.basename(file_path)}")
-
-            # Удаление временного файла
-            if os.path.exists(file_path):
-                os.unlink(file_path)
-                logger.info(f"🗑️ Временный файл удален: {file_path}")
-
-        except Exception as e:
-            logger.error(f"Ошибка при отправке email: {str(e)}")
-            raise
-
-    def _get_custom_content(self, processing_stats):
-        """Генерация кастомного контента для письма"""
-        if not processing_stats:
-            return ""
-            
-        content_parts = []
-        
-        if processing_stats.get('applied_rules', 0) > 0:
-            content_parts.append(f"✅ Успешно применены правила замены для {processing_stats['applied_rules']} типов записей")
-            
-        if processing_stats.get('created_columns', 0) > 0:
-            content_parts.append(f"📊 Добавлено новых колонок: {processing_stats['created_columns']}")
-            
-        return "\n".join(content_parts)
-
-    def _get_footer_text(self, email_template):
-        """Получение текста футера"""
-        if email_template and 'footer_text' in email_template:
-            return email_template['footer_text']
-        return "Автоматическая обработка Excel Mail Processor v8.0\nООО ТРАНСФОРА"
-
-    def _build_legacy_email_body(self, email_template, template_data):
-        """Построение письма в стиле v6.0 для совместимости"""
-        header = email_template.get('body_header', 'Результат автоматической обработки файла дислокации вагонов.')
-        footer = email_template.get('body_footer', 'ООО ТРАНСФОРА')
-        
-        body = f"""{header}
-
-Исходный файл: {template_data['source_filename']}
-Обработанный файл: {template_data['output_filename']}
-Отправитель: {template_data['sender_email']}
-Дата и время обработки: {template_data['processing_date']}
-
-Статистика обработки:
-- Обработано строк: {template_data['processed_rows']}
-- Применено правил замены: {template_data['applied_rules']}
-- Создано колонок: {template_data['created_columns']}
-
-
----
-{footer}"""
-        return body
-
-    def _get_default_email_body_v8(self):
-        """Получение стандартного шаблона письма v8.0"""
-        template = """Результат автоматической обработки файла дислокации вагонов.
-
-
-Приложение к письму: {output_filename}
-
----
-{footer_text}"""
-        return template
-
-    def mark_emails_as_read(self, emails_data):
-        """Пометка писем как прочитанных"""
-        try:
-            with MailBox(self.config.imap_server, port=self.config.imap_port).login(
-                self.config.imap_user,
-                self.config.imap_password,
-                'INBOX'
-            ) as mailbox:
-                uids = [email_data['uid'] for email_data in emails_data]
-                mailbox.flag(uids, ['\\Seen'], True)
-                logger.info(f"Помечено как прочитанных: {len(uids)} писем")
-        except Exception as e:
-            logger.error(f"Ошибка при отметке писем как прочитанных: {str(e)}")
-
-    # Обратная совместимость с v6.0
-    def send_processed_file(self, file_path, original_filename, sender_email, email_template=None):
-        """Обратная совместимость с v6.0"""
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Модуль работы с электронной почтой v8.0
+Получение писем и отправка результатов
+ИСПРАВЛЕНИЯ v8.0:
+- Поддержка настраиваемых email шаблонов из OneDrive
+- Расширенные переменные для подстановки
+- Улучшенное логирование отправки
+"""
+
+import os
+import re
+import time
+import logging
+import tempfile
+import base64
+from email.utils import formataddr
+from datetime import datetime
+from functools import lru_cache
+from string import Formatter
+from logger import get_logger
+
+# Тяжелые модули (imap_tools, smtplib, ssl, email.mime.*) импортируются
+# лениво внутри методов: код, которому нужен только конфиг или шаблоны,
+# не платит за их загрузку
+
+logger = get_logger(__name__)
+
+# BODYSTRUCTURE содержит только метаданные частей письма, поэтому
+# расширение .xls/.xlsx в ответе означает имя вложения или name-параметр
+_BODYSTRUCTURE_EXCEL_RE = re.compile(rb'\.xlsx?', re.IGNORECASE)
+_BODYSTRUCTURE_UID_RE = re.compile(rb'UID (\d+)')
+
+# Кодированные слова RFC 2047 в именах файлов (Outlook кодирует
+# кириллические имена вроде Дислокация.xlsx — буквального '.xlsx'
+# в ответе BODYSTRUCTURE тогда нет)
+_BODYSTRUCTURE_ENCODED_RE = re.compile(rb'=\?[^?]+\?[BQ]\?', re.IGNORECASE)
+
+# Часть с disposition attachment — кандидат независимо от имени
+_BODYSTRUCTURE_ATTACHMENT_RE = re.compile(rb'"ATTACHMENT"', re.IGNORECASE)
+
+# Расширения Excel файлов (проверка по суффиксу без копии всего имени)
+_EXCEL_EXTS = frozenset({'.xlsx', '.xls'})
+
+_INBOX = 'INBOX'
+
+# Шаблоны писем — константы уровня модуля: строки не пересобираются на
+# каждую отправку и попадают в кэш скомпилированных шаблонов
+_DEFAULT_BODY_V8 = """Результат автоматической обработки файла дислокации вагонов.
+
+
+Приложение к письму: {output_filename}
+
+---
+{footer_text}"""
+
+_LEGACY_BODY_TEMPLATE = """{body_header}
+
+Исходный файл: {source_filename}
+Обработанный файл: {output_filename}
+Отправитель: {sender_email}
+Дата и время обработки: {processing_date}
+
+Статистика обработки:
+- Обработано строк: {processed_rows}
+- Применено правил замены: {applied_rules}
+- Создано колонок: {created_columns}
+
+
+---
+{body_footer}"""
+
+@lru_cache(maxsize=1)
+def _ssl_context():
+    """SSL контекст создается один раз на процесс (чтение CA bundle с диска)"""
+    import ssl
+    return ssl.create_default_context()
+
+@lru_cache(maxsize=32)
+def _compile_template(template):
+    """
+    Предварительный разбор format-шаблона письма
+    Шаблон разбивается на сегменты один раз, повторные отправки
+    переиспользуют готовый рендер вместо повторного парсинга строки
+    """
+    segments = list(Formatter().parse(template))
+
+    # Сложные поля ({a.b}, {a[0]}) отдаем стандартному format
+    for _, field, _, _ in segments:
+        if field and ('.' in field or '[' in field):
+            return lambda data: template.format(**data)
+
+    def render(data):
+        parts = []
+        for literal, field, spec, conversion in segments:
+            if literal:
+                parts.append(literal)
+            if field is not None:
+                value = data[field]
+                if conversion == 'r':
+                    value = repr(value)
+                parts.append(format(value, spec) if spec else str(value))
+        return ''.join(parts)
+
+    return render
+
+def _render_template(template, data):
+    """Рендер шаблона через кэш скомпилированных шаблонов"""
+    return _compile_template(template)(data)
+
+class EmailHandler:
+    """Обработчик электронной почты v8.0"""
+
+    # Время жизни SMTP соединения между переподключениями (секунд)
+    _SMTP_TTL = 100
+
+    def __init__(self, config):
+        """Инициализация обработчика"""
+        self.config = config
+        self._mailbox = None
+        self._smtp = None
+        self._smtp_deadline = 0
+        # Заголовок From не меняется между отправками — собираем один раз
+        # (formataddr заодно дает корректное RFC-кодирование имени)
+        self._from_header = formataddr((config.sender_name, config.smtp_user))
+
+    def _get_mailbox(self):
+        """
+        Получение живого IMAP соединения
+        Соединение кэшируется на время жизни обработчика и
+        переоткрывается лениво при обрыве (NOOP-проверка)
+        """
+        if self._mailbox is not None:
+            try:
+                self._mailbox.client.noop()
+                return self._mailbox
+            except Exception:
+                logger.warning("IMAP соединение потеряно, переподключаемся...")
+                self._close_mailbox()
+
+        from imap_tools import MailBox
+
+        self._mailbox = MailBox(self.config.imap_server, port=self.config.imap_port).login(
+            self.config.imap_user,
+            self.config.imap_password,
+            _INBOX
+        )
+        return self._mailbox
+
+    def _close_mailbox(self):
+        """Закрытие IMAP соединения (ошибки при logout игнорируются)"""
+        if self._mailbox is not None:
+            try:
+                self._mailbox.logout()
+            except Exception:
+                pass
+            self._mailbox = None
+
+    def _get_smtp(self):
+        """
+        Получение живого SMTP соединения
+        Соединение кэшируется до истечения _SMTP_TTL, проверяется NOOP
+        и переоткрывается лениво при обрыве
+        """
+        import smtplib
+
+        now = time.monotonic()
+        if self._smtp is not None:
+            if now < self._smtp_deadline:
+                try:
+                    self._smtp.noop()
+                    return self._smtp
+                except (smtplib.SMTPException, OSError):
+                    # OSError покрывает обрывы на уровне TCP (reset/broken
+                    # pipe от NAT и файрволов), которые не заворачиваются
+                    # в SMTPException
+                    logger.warning("SMTP соединение потеряно, переподключаемся...")
+            self._close_smtp()
+
+        if self.config.smtp_port == 465:
+            server = smtplib.SMTP_SSL(self.config.smtp_server, self.config.smtp_port, context=_ssl_context())
+        else:
+            server = smtplib.SMTP(self.config.smtp_server, self.config.smtp_port)
+            server.starttls()
+        server.login(self.config.smtp_user, self.config.smtp_password)
+
+        self._smtp = server
+        self._smtp_deadline = now + self._SMTP_TTL
+        return self._smtp
+
+    def _close_smtp(self):
+        """Закрытие SMTP соединения (ошибки при quit игнорируются)"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+            self._smtp_deadline = 0
+
+    def open_smtp(self):
+        """
+        Прогрев SMTP соединения перед пакетной отправкой
+        Все последующие send_processed_file_v8 переиспользуют сессию
+        без повторного TLS-рукопожатия
+        """
+        self._get_smtp()
+
+    def close_smtp(self):
+        """Закрытие SMTP соединения после пакетной отправки"""
+        self._close_smtp()
+
+    def close(self):
+        """Закрытие сетевых соединений обработчика"""
+        self._close_mailbox()
+        self._close_smtp()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def test_imap_connection(self):
+        """Тестирование IMAP соединения"""
+        try:
+            self._get_mailbox()
+            logger.info("IMAP соединение работает")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка IMAP соединения: {str(e)}")
+            return False
+
+    def test_smtp_connection(self):
+        """Тестирование SMTP соединения"""
+        try:
+            self._get_smtp()
+            logger.info("SMTP соединение работает")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка SMTP соединения: {str(e)}")
+            return False
+
+    def _save_attachment_to_disk(self, payload):
+        """Сохранение вложения во временный файл порциями, возвращает путь"""
+        with tempfile.NamedTemporaryFile(
+            dir=self.config.temp_dir, suffix='.xlsx', delete=False
+        ) as temp_file:
+            view = memoryview(payload)
+            chunk_size = 1024 * 1024
+            for start in range(0, len(view), chunk_size):
+                temp_file.write(view[start:start + chunk_size])
+            return temp_file.name
+
+    def _find_uids_with_excel(self, mailbox):
+        """
+        Предварительный отбор писем по BODYSTRUCTURE без скачивания тел
+        Возвращает список UID непрочитанных писем с Excel вложениями,
+        либо None если отбор не удался (тогда скачиваем все непрочитанные)
+        """
+        try:
+            status, data = mailbox.client.uid('search', None, 'UNSEEN')
+            if status != 'OK':
+                return None
+            if not data or not data[0]:
+                return []
+            unseen_uids = data[0].split()
+
+            status, data = mailbox.client.uid('fetch', b','.join(unseen_uids), '(BODYSTRUCTURE)')
+            if status != 'OK':
+                return None
+
+            uids = []
+            for item in data:
+                if isinstance(item, tuple):
+                    raw = b''.join(part for part in item if isinstance(part, bytes))
+                elif isinstance(item, bytes):
+                    raw = item
+                else:
+                    continue
+                uid_match = _BODYSTRUCTURE_UID_RE.search(raw)
+                if not uid_match:
+                    continue
+                # Отбор консервативный: имя в кодированном слове RFC 2047
+                # не содержит буквального '.xlsx', поэтому такие части и
+                # части с disposition attachment тоже считаем кандидатами.
+                # Ложный кандидат стоит одной лишней загрузки тела,
+                # пропущенное письмо остается непрочитанным навсегда
+                if (_BODYSTRUCTURE_EXCEL_RE.search(raw)
+                        or _BODYSTRUCTURE_ENCODED_RE.search(raw)
+                        or _BODYSTRUCTURE_ATTACHMENT_RE.search(raw)):
+                    uids.append(uid_match.group(1).decode())
+            return uids
+        except Exception as e:
+            logger.warning(f"Не удалось отобрать письма по BODYSTRUCTURE: {str(e)}")
+            return None
+
+    def get_unread_emails_with_excel(self):
+        """Получение непрочитанных писем с Excel вложениями"""
+        try:
+            from imap_tools import AND, MailMessageFlags
+
+            emails_with_excel = []
+            # UID осмотренных писем без подходящих Excel вложений:
+            # помечаются прочитанными, иначе они навсегда остаются UNSEEN
+            # и проходят префильтр со скачиванием тела на каждом запуске
+            skipped_uids = []
+            mailbox = self._get_mailbox()
+
+            # Сначала отбираем письма по структуре на сервере,
+            # тела скачиваем только для кандидатов с Excel вложениями
+            excel_uids = self._find_uids_with_excel(mailbox)
+            if excel_uids is not None:
+                if not excel_uids:
+                    logger.info("Непрочитанных писем с Excel вложениями нет (BODYSTRUCTURE)")
+                    return []
+                criteria = AND(uid=excel_uids, seen=False)
+                logger.info(f"Отобрано по BODYSTRUCTURE: {len(excel_uids)} писем-кандидатов")
+            else:
+                criteria = AND(seen=False)
+
+            # Проверяем уровень логирования один раз, а не в каждой итерации
+            info_enabled = logger.isEnabledFor(logging.INFO)
+
+            # mark_seen=False: письма помечаются прочитанными только после
+            # успешной обработки (mark_emails_as_read), bulk=True собирает
+            # FETCH в одну команду вместо запроса на каждое письмо
+            for msg in mailbox.fetch(criteria, mark_seen=False, bulk=True):
+                excel_attachments = []
+                # Проверка вложений
+                for attachment in msg.attachments:
+                    filename = attachment.filename
+                    if not filename:
+                        continue
+                    # Проверяем только суффикс, не создавая lower-копию имени
+                    dot = filename.rfind('.')
+                    if dot < 0 or filename[dot:].lower() not in _EXCEL_EXTS:
+                        continue
+
+                    # В imap_tools 1.7.2 attachment.size сам декодирует
+                    # payload, поэтому отдельной «дешевой» проверки размера
+                    # нет — сразу считаем размер декодированных данных
+                    file_size_mb = len(attachment.payload) / (1024 * 1024)
+                    if file_size_mb <= self.config.max_file_size_mb:
+                        # Сохраняем вложение на диск — дальше по коду передается
+                        # только путь, а не содержимое файла в памяти
+                        temp_path = self._save_attachment_to_disk(attachment.payload)
+                        excel_attachments.append({
+                            'filename': filename,
+                            'path': temp_path,
+                            'size_mb': file_size_mb
+                        })
+                        if info_enabled:
+                            logger.info("Найдено Excel вложение: %s (%.2f МБ)", filename, file_size_mb)
+                    else:
+                        logger.warning("Файл %s превышает максимальный размер (%.2f МБ)", filename, file_size_mb)
+
+                if excel_attachments:
+                    emails_with_excel.append({
+                        'uid': msg.uid,
+                        'sender': msg.from_,
+                        'subject': msg.subject,
+                        'date': msg.date,
+                        'attachments': excel_attachments
+                    })
+                    if info_enabled:
+                        logger.info("Письмо от %s содержит %d Excel файлов", msg.from_, len(excel_attachments))
+                else:
+                    skipped_uids.append(msg.uid)
+
+            if skipped_uids:
+                # Один UID STORE на весь список; ошибка пометки не должна
+                # срывать обработку найденных писем
+                try:
+                    mailbox.flag(skipped_uids, [MailMessageFlags.SEEN], True)
+                    logger.info(f"Писем без Excel вложений помечено прочитанными: {len(skipped_uids)}")
+                except Exception as e:
+                    logger.warning(f"Не удалось пометить письма без вложений: {str(e)}")
+
+            return emails_with_excel
+        except Exception as e:
+            logger.error(f"Ошибка при получении писем: {str(e)}")
+            return []
+
+    def send_processed_file_v8(self, file_path, original_filename, sender_email, email_template=None, processing_stats=None):
+        """
+        Отправка обработанного файла v8.0 с поддержкой настраиваемых шаблонов
+        """
+        import smtplib
+        from email.message import EmailMessage, MIMEPart
+
+        try:
+            # Подготовка данных для шаблона v8.0
+            now = datetime.now()
+
+            # Имя файла вычисляется один раз и переиспользуется ниже
+            output_filename = os.path.basename(file_path)
+
+            # Расширенный набор переменных для v8.0
+            template_data = {
+                'source_filename': original_filename,
+                'output_filename': output_filename,
+                'sender_email': sender_email,
+                'processing_date': now.strftime("%Y-%m-%d %H:%M:%S"),
+                'processing_date_short': now.strftime("%Y-%m-%d"),
+                'processing_time': now.strftime("%H:%M"),
+                'processed_rows': processing_stats.get('processed_rows', 0) if processing_stats else 0,
+                'applied_rules': processing_stats.get('applied_rules', 0) if processing_stats else 0,
+                'created_columns': processing_stats.get('created_columns', 0) if processing_stats else 0,
+                'custom_content': self._get_custom_content(processing_stats),
+                'footer_text': self._get_footer_text(email_template)
+            }
+
+            # Формирование темы и текста письма v8.0
+            if email_template and 'body_template' in email_template:
+                # Новый подход v8.0: полный шаблон из OneDrive
+                subject = _render_template(email_template.get('subject', 'Обработанный файл: {output_filename}'), template_data)
+                body = _render_template(email_template['body_template'], template_data)
+                logger.info("✅ Используется настраиваемый шаблон письма v8.0 из OneDrive")
+            elif email_template:
+                # Совместимость с v6.0
+                subject = _render_template(email_template.get('subject', 'Обработанный файл: {output_filename}'), template_data)
+                body = self._build_legacy_email_body(email_template, template_data)
+                logger.info("📧 Используется совместимый шаблон письма v6.0")
+            else:
+                # Стандартный шаблон
+                subject = f"Обработанный файл: {output_filename}"
+                body = _render_template(self._get_default_email_body_v8(), template_data)
+                logger.info("📧 Используется стандартный шаблон письма")
+
+            # Создание сообщения (EmailMessage собирает multipart за один
+            # проход без промежуточных строковых копий MIMEMultipart)
+            msg = EmailMessage()
+            msg['From'] = self._from_header
+            msg['To'] = self.config.recipient_email
+            msg['Subject'] = subject
+
+            # Добавление текста
+            msg.set_content(body)
+            msg.make_mixed()
+
+            # Добавление вложения
+            # Файл кодируется в base64 порциями, чтобы не держать в памяти
+            # одновременно и сырые байты, и закодированную копию
+            encoded_chunks = []
+            with open(file_path, 'rb') as f:
+                while True:
+                    # Порция кратна 57 байтам — строки base64 выходят ровными
+                    block = f.read(57 * 1024)
+                    if not block:
+                        break
+                    encoded_chunks.append(base64.encodebytes(block).decode('ascii'))
+
+            attachment = MIMEPart()
+            attachment['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            attachment['Content-Transfer-Encoding'] = 'base64'
+            attachment.add_header('Content-Disposition', 'attachment', filename=output_filename)
+            attachment.set_payload(''.join(encoded_chunks))
+            msg.attach(attachment)
+
+            # Отправка письма через кэшированное соединение
+            try:
+                self._get_smtp().send_message(msg)
+            except (smtplib.SMTPException, OSError):
+                # Сбрасываем кэш — следующий вызов переподключится
+                # (OSError — обрыв сокета, не завернутый в SMTPException)
+                self._close_smtp()
+                raise
+
+            logger.info(f"✅ Email отправлен успешно на {self.config.recipient_email}")
+            logger.info(f"📧 Тема: {subject}")
+            logger.info(f"📎 Вложение: {output_filename}")
+
+            # Удаление временного файла
+            # Без предварительного os.path.exists: один системный вызов
+            # вместо двух и нет гонки между проверкой и удалением
+            try:
+                os.unlink(file_path)
+                logger.info(f"🗑️ Временный файл удален: {file_path}")
+            except FileNotFoundError:
+                pass
+
+            # Уникальный каталог результата удаляется вместе с файлом;
+            # для общих каталогов (/tmp) rmdir безвредно откажет
+            try:
+                os.rmdir(os.path.dirname(file_path))
+            except OSError:
+                pass
+
+        except Exception as e:
+            logger.error(f"Ошибка при отправке email: {str(e)}")
+            raise
+
+    def _get_custom_content(self, processing_stats):
+        """Генерация кастомного контента для письма"""
+        if not processing_stats:
+            return ""
+            
+        content_parts = []
+        
+        if processing_stats.get('applied_rules', 0) > 0:
+            content_parts.append(f"✅ Успешно применены правила замены для {processing_stats['applied_rules']} типов записей")
+            
+        if processing_stats.get('created_columns', 0) > 0:
+            content_parts.append(f"📊 Добавлено новых колонок: {processing_stats['created_columns']}")
+            
+        return "\n".join(content_parts)
+
+    def _get_footer_text(self, email_template):
+        """Получение текста футера"""
+        if email_template and 'footer_text' in email_template:
+            return email_template['footer_text']
+        return "Автоматическая обработка Excel Mail Processor v8.0\nООО ТРАНСФОРА"
+
+    def _build_legacy_email_body(self, email_template, template_data):
+        """Построение письма в стиле v6.0 для совместимости"""
+        header = email_template.get('body_header', 'Результат автоматической обработки файла дислокации вагонов.')
+        footer = email_template.get('body_footer', 'ООО ТРАНСФОРА')
+
+        return _render_template(
+            _LEGACY_BODY_TEMPLATE,
+            {**template_data, 'body_header': header, 'body_footer': footer}
+        )
+
+    def _get_default_email_body_v8(self):
+        """Получение стандартного шаблона письма v8.0"""
+        return _DEFAULT_BODY_V8
+
+    def mark_emails_as_read(self, emails_data):
+        """Пометка писем как прочитанных"""
+        try:
+            from imap_tools import MailMessageFlags
+
+            mailbox = self._get_mailbox()
+            uids = [email_data['uid'] for email_data in emails_data]
+            # Один UID STORE на весь список вместо команды на каждое письмо
+            mailbox.flag(uids, [MailMessageFlags.SEEN], True)
+            logger.info(f"Помечено как прочитанных: {len(uids)} писем")
+        except Exception as e:
+            logger.error(f"Ошибка при отметке писем как прочитанных: {str(e)}")
+
+    # Обратная совместимость с v6.0
+    def send_processed_file(self, file_path, original_filename, sender_email, email_template=None):
+        """Обратная совместимость с v6.0"""
         return self.send_processed_file_v8(file_path, original_filename, sender_email, email_template)
\ No newline at end of file
@@ -1,394 +1,453 @@
-#!/usr/bin/env python3
-
-# -*- coding: utf-8 -*-
-
-"""
-Модуль обработки Excel файлов v8.1
-Специализированная логика для файлов дислокации вагонов
-
-ИСПРАВЛЕНИЯ v8.1:
-- Добавлена поддержка обработки колонок с датами
-- Гибкое форматирование дат согласно инструкциям OneDrive
-- Обратная совместимость с v8.0
-
-ИСПРАВЛЕНИЯ v8.0:
-- Исправлено именование результирующих файлов
-- Добавлено цветовое форматирование из OneDrive
-- Улучшена статистика обработки
-"""
-
-import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
-import tempfile
-import os
-import shutil
-from datetime import datetime
-import locale
-import re
-from logger import get_logger
-
-logger = get_logger(__name__)
-
-class ExcelProcessor:
-    """Обработчик Excel файлов v8.1"""
-    
-    def __init__(self, instructions):
-        """Инициализация обработчика"""
-        self.instructions = instructions
-        self.processing_stats = {
-            'processed_rows': 0,
-            'applied_rules': 0,
-            'created_columns': 0,
-            'formatted_date_columns': 0  # Новая статистика v8.1
-        }
-        
-        # Словарь для преобразования названий месяцев
-        self.month_names = {
-            'ru': {
-                1: 'янв', 2: 'фев', 3: 'мар', 4: 'апр', 5: 'май', 6: 'июн',
-                7: 'июл', 8: 'авг', 9: 'сен', 10: 'окт', 11: 'ноя', 12: 'дек'
-            },
-            'ru_full': {
-                1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля', 5: 'мая', 6: 'июня',
-                7: 'июля', 8: 'августа', 9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
-            },
-            'en': {
-                1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun',
-                7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec'
-            },
-            'en_full': {
-                1: 'January', 2: 'February', 3: 'March', 4: 'April', 5: 'May', 6: 'June',
-                7: 'July', 8: 'August', 9: 'September', 10: 'October', 11: 'November', 12: 'December'
-            }
-        }
-    
-    def process_file(self, file_content, original_filename):
-        """Обработка Excel файла с правильным именованием и поддержкой дат v8.1"""
-        try:
-            logger.info(f"Начинаем обработку файла {original_filename}")
-            
-            # Сохранение входного файла во временный файл
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_input:
-                temp_input.write(file_content)
-                temp_input_path = temp_input.name
-            
-            # Чтение Excel файла
-            df = pd.read_excel(temp_input_path)
-            
-            # Определение листа для обработки
-            workbook = openpyxl.load_workbook(temp_input_path)
-            sheet_name = workbook.sheetnames[0]
-            logger.info(f"Обрабатываем лист: {sheet_name}")
-            logger.info(f"Найдено столбцов в файле: {len(df.columns)}")
-            logger.info(f"Заголовки: {list(df.columns)}")
-            
-            # Подготовка целевых колонок
-            target_columns = [col['target_name'] for col in self.instructions['columns']]
-            logger.info(f"Целевые столбцы из инструкции: {target_columns}")
-            
-            # Создание результирующего DataFrame
-            result_df = pd.DataFrame()
-            
-            # Обработка каждой колонки согласно инструкции
-            columns_processed = 0
-            for col_config in self.instructions['columns']:
-                source_name = col_config['source_name']
-                target_name = col_config['target_name']
-                action = col_config['action']
-                value = col_config['value']
-                
-                # Новые параметры для дат v8.1
-                is_date = col_config.get('is_date', False)
-                date_format = col_config.get('date_format', 'DD.MM.YYYY')
-                date_locale = col_config.get('date_locale', 'ru')
-                
-                if action == 'create':
-                    # Создание новой колонки
-                    if target_name == 'проект':
-                        result_df[target_name] = ''
-                        logger.info(f"✅ Колонка '{target_name}' создана для заполнения по правилам")
-                    elif target_name == 'Экспедитор':
-                        fixed_value = value if value else "ООО ТРАНСФОРА"
-                        result_df[target_name] = fixed_value
-                        logger.info(f"✅ Колонка '{target_name}' создана с фиксированным значением '{fixed_value}'")
-                    else:
-                        result_df[target_name] = value if value else ''
-                        logger.info(f"✅ Колонка '{target_name}' создана с значением '{value}'")
-                    
-                    self.processing_stats['created_columns'] += 1
-                    columns_processed += 1
-                    
-                elif action == 'copy' or action is None:
-                    # Копирование существующей колонки
-                    source_col = self._find_column_case_insensitive(df, source_name)
-                    if source_col:
-                        # Копирование данных
-                        result_df[target_name] = df[source_col]
-                        
-                        # Обработка дат v8.1
-                        if is_date:
-                            result_df[target_name] = self._format_date_column(
-                                result_df[target_name], 
-                                date_format, 
-                                date_locale
-                            )
-                            self.processing_stats['formatted_date_columns'] += 1
-                            logger.info(f"✅ Колонка '{source_col}' скопирована как '{target_name}' с форматированием дат ({date_format})")
-                        else:
-                            logger.info(f"✅ Колонка '{source_col}' скопирована как '{target_name}'")
-                        
-                        columns_processed += 1
-                    else:
-                        logger.warning(f"⚠️ Колонка '{source_name}' не найдена в файле")
-                        result_df[target_name] = ''
-                        columns_processed += 1
-            
-            logger.info(f"Выбрано столбцов для обработки: {columns_processed}")
-            
-            # Применение правил замены
-            self._apply_replace_rules(result_df)
-            
-            # Обновление статистики
-            self.processing_stats['processed_rows'] = len(result_df)
-            logger.info(f"Обработано строк данных: {len(result_df)}")
-            if self.processing_stats['formatted_date_columns'] > 0:
-                logger.info(f"Отформатировано колонок с датами: {self.processing_stats['formatted_date_columns']}")
-            
-            # Создание выходного файла с правильным именем
-            output_path = self._create_output_file_v8(result_df, original_filename)
-            
-            # Удаление временного файла
-            os.unlink(temp_input_path)
-            
-            logger.info(f"Файл {original_filename} обработан успешно -> {os.path.basename(output_path)}")
-            return output_path
-            
-        except Exception as e:
-            logger.error(f"Ошибка при обработке файла {original_filename}: {str(e)}")
-            raise
-    
-    def _format_date_column(self, series, date_format, date_locale='ru'):
-        """
-        Форматирование колонки с датами v8.1
-        
-        Args:
-            series: pandas Series с датами
-            date_format: формат вывода (DD.MM.YYYY, DD MMM YYYY, etc.)
-            date_locale: локаль для названий месяцев
-        
-        Returns:
-            pandas Series с отформатированными датами
-        """
-        try:
-            def format_single_date(date_value):
-                if pd.isna(date_value) or date_value is None:
-                    return ''
-                
-                try:
-                    # Попытка преобразовать в datetime
-                    if isinstance(date_value, str):
-                        # Попробуем разные форматы парсинга
-                        for fmt in ['%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%m/%d/%Y', '%Y-%m-%d %H:%M:%S']:
-                            try:
-                                parsed_date = datetime.strptime(date_value, fmt)
-                                break
-                            except ValueError:
-                                continue
-                        else:
-                            # Если не удалось распарсить, попробуем pandas
-                            parsed_date = pd.to_datetime(date_value, errors='coerce')
-                            if pd.isna(parsed_date):
-                                return str(date_value)  # Возвращаем как есть
-                    else:
-                        # Уже datetime или Timestamp
-                        parsed_date = pd.to_datetime(date_value)
-                    
-                    if pd.isna(parsed_date):
-                        return str(date_value)
-                    
-                    # Форматирование согласно заданному формату
-                    day = parsed_date.day
-                    month = parsed_date.month
-                    year = parsed_date.year
-                    
-                    if date_format == 'DD.MM.YYYY':
-                        return f"{day:02d}.{month:02d}.{year}"
-                    elif date_format == 'DD/MM/YYYY':
-                        return f"{day:02d}/{month:02d}/{year}"
-                    elif date_format == 'DD-MM-YYYY':
-                        return f"{day:02d}-{month:02d}-{year}"
-                    elif date_format == 'YYYY-MM-DD':
-                        return f"{year}-{month:02d}-{day:02d}"
-                    elif date_format == 'MM/DD/YYYY':
-                        return f"{month:02d}/{day:02d}/{year}"
-                    elif date_format == 'DD MMM YYYY':
-                        month_name = self.month_names.get(date_locale, self.month_names['ru'])[month]
-                        return f"{day:02d} {month_name} {year}"
-                    elif date_format == 'DD MMMM YYYY':
-                        month_name = self.month_names.get(f"{date_locale}_full", self.month_names['ru_full'])[month]
-                        return f"{day:02d} {month_name} {year}"
-                    else:
-                        # Формат по умолчанию
-                        return f"{day:02d}.{month:02d}.{year}"
-                        
-                except Exception as e:
-                    logger.warning(f"Ошибка форматирования даты '{date_value}': {e}")
-                    return str(date_value)  # Возвращаем как есть при ошибке
-            
-            # Применяем форматирование ко всей серии
-            formatted_series = series.apply(format_single_date)
-            
-            logger.info(f"✅ Отформатировано {len(formatted_series)} дат в формате {date_format}")
-            return formatted_series
-            
-        except Exception as e:
-            logger.error(f"Критическая ошибка форматирования дат: {e}")
-            return series  # Возвращаем исходную серию при критической ошибке
-    
-    def _find_column_case_insensitive(self, df, column_name):
-        """Поиск колонки без учета регистра"""
-        for col in df.columns:
-            if str(col).lower().strip() == str(column_name).lower().strip():
-                return col
-        return None
-    
-    def _apply_replace_rules(self, df):
-        """Применение правил замены с подсчетом статистики"""
-        rules_applied = 0
-        for rule in self.instructions['replace_rules']:
-            column = rule['column']
-            find_value = rule['find_value']
-            replace_value = rule['replace_value']
-            project_value = rule.get('project_value')
-            project_value2 = rule.get('project_value2')
-            
-            # Поиск колонки в DataFrame
-            target_col = self._find_column_case_insensitive(df, column)
-            if not target_col:
-                logger.warning(f"⚠️ Колонка '{column}' для правила замены не найдена")
-                continue
-            
-            # Применение правила замены
-            mask = df[target_col].astype(str) == str(find_value)
-            affected_rows = mask.sum()
-            
-            if affected_rows > 0:
-                # Замена значений в исходной колонке
-                df.loc[mask, target_col] = replace_value
-                
-                # Установка значения проекта, если указано
-                if project_value and 'проект' in df.columns:
-                    df.loc[mask, 'проект'] = project_value
-                    logger.info(f"✅ Установлено значение проекта '{project_value}' для {affected_rows} строк (значение: {find_value})")
-                
-                if project_value2 and 'Заявка' in df.columns:
-                    df.loc[mask, 'Заявка'] = project_value2
-                    logger.info(f"✅ Установлено значение проекта '{project_value2}' для {affected_rows} строк (значение: {find_value})")
-                
-                rules_applied += 1
-                logger.info(f"✅ Правило замены применено: '{find_value}' -> '{replace_value}' в колонке '{target_col}' ({affected_rows} строк)")
-            else:
-                logger.info(f"ℹ️ Правило замены не применено: значение '{find_value}' не найдено в колонке '{target_col}'")
-        
-        self.processing_stats['applied_rules'] = rules_applied
-        logger.info(f"Применено правил замены: {rules_applied}")
-    
-    def _create_output_file_v8(self, df, original_filename):
-        """
-        Создание выходного файла с правильным именованием v8.0
-        ИСПРАВЛЕНИЕ: Теперь файл создается с правильным именем, а не временным
-        """
-        # Генерация имени файла с датой и временем
-        now = datetime.now()
-        timestamp = now.strftime("%Y-%m-%d-%H-%M")
-        output_filename = f"TRANSFORA_dislocation_{timestamp}.xlsx"
-        
-        # Создание временного файла
-        temp_output = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        temp_output.close()
-        
-        # Сохранение DataFrame в Excel
-        with pd.ExcelWriter(temp_output.name, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Дислокация', index=False)
-            
-            # Получение объекта workbook для форматирования
-            workbook = writer.book
-            worksheet = writer.sheets['Дислокация']
-            
-            # Применение форматирования v8.0 с цветами
-            self._apply_formatting_v8(worksheet, df)
-        
-        # ИСПРАВЛЕНИЕ v8.0: Создание файла с правильным именем
-        temp_dir = os.path.dirname(temp_output.name)
-        final_output_path = os.path.join(temp_dir, output_filename)
-        
-        # Перемещение временного файла в файл с правильным именем
-        shutil.move(temp_output.name, final_output_path)
-        
-        logger.info(f"✅ Файл сохранен с правильным именем: {output_filename}")
-        return final_output_path
-    
-    def _apply_formatting_v8(self, worksheet, df):
-        """
-        Применение форматирования v8.0 с поддержкой цветов из OneDrive
-        """
-        # Получение настроек форматирования из инструкций
-        formatting = self.instructions.get('formatting', {})
-        
-        # Настройки по умолчанию
-        default_font_name = formatting.get('font_name', 'Calibri')
-        default_font_size = int(formatting.get('font_size', 10))
-        
-        # Цвета заголовков
-        header_bg_color = formatting.get('header_background_color', 'DDDDDD')
-        header_text_color = formatting.get('header_text_color', '000000')
-        
-        # Цвета ячеек
-        cell_bg_color = formatting.get('cell_background_color', 'FFFFFF')
-        
-        # Базовый шрифт
-        base_font = Font(name=default_font_name, size=default_font_size)
-        
-        # Применение шрифта ко всем ячейкам
-        for row in worksheet.iter_rows():
-            for cell in row:
-                cell.font = base_font
-                cell.alignment = Alignment(vertical='center')
-                
-                # Цвет фона для обычных ячеек
-                if cell_bg_color and cell_bg_color != 'FFFFFF':
-                    cell.fill = PatternFill(start_color=cell_bg_color,
-                                          end_color=cell_bg_color,
-                                          fill_type='solid')
-        
-        # Автоподбор ширины колонок
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            
-            for cell in column:
-                try:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                except:
-                    pass
-            
-            # Установка ширины с ограничениями
-            adjusted_width = min(max(max_length + 2, 10), 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-        
-        # Форматирование заголовков с цветами
-        header_font = Font(name=default_font_name, size=default_font_size, bold=True, color=header_text_color)
-        header_fill = PatternFill(start_color=header_bg_color, end_color=header_bg_color, fill_type='solid')
-        
-        for cell in worksheet[1]:
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-        
-        logger.info(f"✅ Применено форматирование v8.0: шрифт {default_font_name} {default_font_size}pt, цвета из OneDrive")
-    
-    def get_processing_statistics(self):
-        """Получение статистики обработки для email шаблонов v8.1"""
+#!/usr/bin/env python3
+
+# -*- coding: utf-8 -*-
+
+"""
+Модуль обработки Excel файлов v8.1
+Специализированная логика для файлов дислокации вагонов
+
+ИСПРАВЛЕНИЯ v8.1:
+- Добавлена поддержка обработки колонок с датами
+- Гибкое форматирование дат согласно инструкциям OneDrive
+- Обратная совместимость с v8.0
+
+ИСПРАВЛЕНИЯ v8.0:
+- Исправлено именование результирующих файлов
+- Добавлено цветовое форматирование из OneDrive
+- Улучшена статистика обработки
+"""
+
+import io
+import pandas as pd
+import openpyxl
+from openpyxl.styles import Font, Alignment, PatternFill
+import tempfile
+import os
+from datetime import datetime
+import locale
+import logging
+import re
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+class ExcelProcessor:
+    """Обработчик Excel файлов v8.1"""
+    
+    def __init__(self, instructions):
+        """Инициализация обработчика"""
+        self.instructions = instructions
+        self.processing_stats = {
+            'processed_rows': 0,
+            'applied_rules': 0,
+            'created_columns': 0,
+            'formatted_date_columns': 0  # Новая статистика v8.1
+        }
+
+        # Кэш индекса колонок для _find_column_case_insensitive
+        self._col_index = {}
+        self._col_index_key = None
+
+        # Словарь для преобразования названий месяцев
+        self.month_names = {
+            'ru': {
+                1: 'янв', 2: 'фев', 3: 'мар', 4: 'апр', 5: 'май', 6: 'июн',
+                7: 'июл', 8: 'авг', 9: 'сен', 10: 'окт', 11: 'ноя', 12: 'дек'
+            },
+            'ru_full': {
+                1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля', 5: 'мая', 6: 'июня',
+                7: 'июля', 8: 'августа', 9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
+            },
+            'en': {
+                1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun',
+                7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec'
+            },
+            'en_full': {
+                1: 'January', 2: 'February', 3: 'March', 4: 'April', 5: 'May', 6: 'June',
+                7: 'July', 8: 'August', 9: 'September', 10: 'October', 11: 'November', 12: 'December'
+            }
+        }
+
+        # Скомпилированный план обработки колонок: параметры инструкции
+        # читаются из словарей один раз на процессор, а не на каждый файл
+        self._cols = [
+            (
+                col.source_name,
+                col.target_name,
+                col.action,
+                col.value,
+                col.is_date,
+                col.date_format,
+                col.date_locale
+            )
+            for col in instructions['columns']
+        ]
+        self._target_columns = [col[1] for col in self._cols]
+
+        # Правила замены, сгруппированные по нормализованному имени колонки
+        self._rules_by_col = {}
+        for rule in instructions['replace_rules']:
+            key = str(rule['column']).lower().strip()
+            self._rules_by_col.setdefault(key, []).append(rule)
+
+        # Соответствие форматов инструкции шаблонам strftime
+        # Таблица строится один раз при инициализации, а не на каждый
+        # вызов _format_date_column
+        self._strftime_formats = {
+            'DD.MM.YYYY': '%d.%m.%Y',
+            'DD/MM/YYYY': '%d/%m/%Y',
+            'DD-MM-YYYY': '%d-%m-%Y',
+            'YYYY-MM-DD': '%Y-%m-%d',
+            'MM/DD/YYYY': '%m/%d/%Y'
+        }
+    
+    def process_file(self, file_content, original_filename):
+        """
+        Обработка Excel файла с правильным именованием и поддержкой дат v8.1
+        Принимает путь к уже сохраненному файлу или сырые байты (совместимость)
+        """
+        try:
+            logger.info(f"Начинаем обработку файла {original_filename}")
+
+            # Источник данных: путь на диске, file-like объект или сырые
+            # байты — байты оборачиваются в BytesIO без временного файла
+            if isinstance(file_content, (bytes, bytearray)):
+                input_source = io.BytesIO(file_content)
+            else:
+                input_source = file_content
+            
+            # Чтение Excel файла одним проходом в режиме read_only:
+            # раньше файл парсился дважды (pd.read_excel + load_workbook
+            # ради имени листа), теперь SAX-поток openpyxl читается один раз
+            workbook = openpyxl.load_workbook(input_source, read_only=True, data_only=True)
+            try:
+                worksheet = workbook.worksheets[0]
+                sheet_name = worksheet.title
+                rows = worksheet.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    df = pd.DataFrame()
+                else:
+                    # Полностью пустые хвостовые строки не включаем в данные
+                    data_rows = [row for row in rows if any(value is not None for value in row)]
+                    df = pd.DataFrame(data_rows, columns=list(header))
+            finally:
+                workbook.close()
+            logger.info(f"Обрабатываем лист: {sheet_name}")
+            logger.info(f"Найдено столбцов в файле: {len(df.columns)}")
+            logger.info(f"Заголовки: {list(df.columns)}")
+            
+            # Подготовка целевых колонок
+            logger.info(f"Целевые столбцы из инструкции: {self._target_columns}")
+
+            # Колонки накапливаются в словаре и собираются в DataFrame
+            # одним вызовом: поколоночное присваивание заставляло pandas
+            # перестраивать block manager на каждую колонку
+            result_cols = {}
+
+            # Обработка каждой колонки согласно скомпилированному плану
+            # Сообщения в цикле форматируются лениво (%-стиль) и только
+            # если уровень INFO вообще включен
+            info_enabled = logger.isEnabledFor(logging.INFO)
+            columns_processed = 0
+            for source_name, target_name, action, value, is_date, date_format, date_locale in self._cols:
+                if action == 'create':
+                    # Создание новой колонки
+                    if target_name == 'проект':
+                        result_cols[target_name] = ''
+                        if info_enabled:
+                            logger.info("✅ Колонка '%s' создана для заполнения по правилам", target_name)
+                    elif target_name == 'Экспедитор':
+                        fixed_value = value if value else "ООО ТРАНСФОРА"
+                        result_cols[target_name] = fixed_value
+                        if info_enabled:
+                            logger.info("✅ Колонка '%s' создана с фиксированным значением '%s'", target_name, fixed_value)
+                    else:
+                        result_cols[target_name] = value if value else ''
+                        if info_enabled:
+                            logger.info("✅ Колонка '%s' создана с значением '%s'", target_name, value)
+
+                    self.processing_stats['created_columns'] += 1
+                    columns_processed += 1
+
+                elif action == 'copy' or action is None:
+                    # Копирование существующей колонки
+                    source_col = self._find_column_case_insensitive(df, source_name)
+                    if source_col:
+                        # Обработка дат v8.1
+                        if is_date:
+                            result_cols[target_name] = self._format_date_column(
+                                df[source_col],
+                                date_format,
+                                date_locale
+                            )
+                            self.processing_stats['formatted_date_columns'] += 1
+                            if info_enabled:
+                                logger.info("✅ Колонка '%s' скопирована как '%s' с форматированием дат (%s)", source_col, target_name, date_format)
+                        else:
+                            # Обычное копирование отдает ndarray-представление
+                            # без дублирования данных; вместе с copy=False при
+                            # сборке DataFrame массив не копируется вовсе
+                            result_cols[target_name] = df[source_col].values
+                            if info_enabled:
+                                logger.info("✅ Колонка '%s' скопирована как '%s'", source_col, target_name)
+
+                        columns_processed += 1
+                    else:
+                        logger.warning("⚠️ Колонка '%s' не найдена в файле", source_name)
+                        result_cols[target_name] = ''
+                        columns_processed += 1
+
+            result_df = pd.DataFrame(result_cols, index=df.index, copy=False)
+            
+            logger.info(f"Выбрано столбцов для обработки: {columns_processed}")
+            
+            # Применение правил замены
+            self._apply_replace_rules(result_df)
+            
+            # Обновление статистики
+            self.processing_stats['processed_rows'] = len(result_df)
+            logger.info(f"Обработано строк данных: {len(result_df)}")
+            if self.processing_stats['formatted_date_columns'] > 0:
+                logger.info(f"Отформатировано колонок с датами: {self.processing_stats['formatted_date_columns']}")
+            
+            # Создание выходного файла с правильным именем
+            output_path = self._create_output_file_v8(result_df, original_filename)
+            
+            logger.info(f"Файл {original_filename} обработан успешно -> {os.path.basename(output_path)}")
+            return output_path
+            
+        except Exception as e:
+            logger.error(f"Ошибка при обработке файла {original_filename}: {str(e)}")
+            raise
+    
+    def _format_date_column(self, series, date_format, date_locale='ru'):
+        """
+        Форматирование колонки с датами v8.1 (векторизованное)
+
+        Args:
+            series: pandas Series с датами
+            date_format: формат вывода (DD.MM.YYYY, DD MMM YYYY, etc.)
+            date_locale: локаль для названий месяцев
+
+        Returns:
+            pandas Series с отформатированными датами
+        """
+        try:
+            # Формат назначения декодируется один раз до обработки данных
+            strftime_format = self._strftime_formats.get(date_format, '%d.%m.%Y')
+
+            # Быстрый путь: даты из xlsx уже приходят как datetime64,
+            # повторный парсинг таким колонкам не нужен
+            if pd.api.types.is_datetime64_any_dtype(series):
+                parsed = series
+            else:
+                # Один векторизованный парсинг вместо strptime по каждой ячейке
+                parsed = pd.to_datetime(series, errors='coerce', dayfirst=True)
+
+            if date_format in ('DD MMM YYYY', 'DD MMMM YYYY'):
+                # Форматы с названиями месяцев собираем из компонентов даты
+                if date_format == 'DD MMM YYYY':
+                    names = self.month_names.get(date_locale, self.month_names['ru'])
+                else:
+                    names = self.month_names.get(f"{date_locale}_full", self.month_names['ru_full'])
+                # Int64 сохраняет целые значения дней/годов при наличии NaT
+                formatted = (
+                    parsed.dt.day.astype('Int64').astype(str).str.zfill(2)
+                    + ' ' + parsed.dt.month.map(names)
+                    + ' ' + parsed.dt.year.astype('Int64').astype(str)
+                )
+            else:
+                formatted = parsed.dt.strftime(strftime_format)
+
+            # Нераспарсенные значения возвращаем как есть, пустые — пустой строкой
+            result = formatted.where(parsed.notna(), series.astype(str))
+            result = result.mask(series.isna(), '')
+
+            logger.info(f"✅ Отформатировано {len(result)} дат в формате {date_format}")
+            return result
+
+        except Exception as e:
+            logger.error(f"Критическая ошибка форматирования дат: {e}")
+            return series  # Возвращаем исходную серию при критической ошибке
+    
+    def _find_column_case_insensitive(self, df, column_name):
+        """Поиск колонки без учета регистра (O(1) по кэшированному индексу)"""
+        # Индекс нормализованных имен строится один раз на набор колонок,
+        # вместо линейного прохода по df.columns на каждый вызов.
+        # Ключ — сами колонки, а не id(df): адреса объектов после сборки
+        # мусора переиспользуются, и кэш отдавал бы индекс прошлого файла
+        cols_key = tuple(df.columns)
+        if self._col_index_key != cols_key:
+            self._col_index = {str(col).lower().strip(): col for col in df.columns}
+            self._col_index_key = cols_key
+        return self._col_index.get(str(column_name).lower().strip())
+    
+    def _apply_replace_rules(self, df):
+        """Применение правил замены с подсчетом статистики"""
+        rules_applied = 0
+
+        # Правила заранее сгруппированы по колонке в __init__: вместо K
+        # полных проходов по колонке (по одному на правило) выполняется
+        # один Series.map на колонку со словарем всех замен сразу
+        has_project = 'проект' in df.columns
+        has_zayavka = 'Заявка' in df.columns
+
+        for rules in self._rules_by_col.values():
+            target_col = self._find_column_case_insensitive(df, rules[0]['column'])
+            if not target_col:
+                logger.warning(f"⚠️ Колонка '{rules[0]['column']}' для правила замены не найдена")
+                continue
+            col_str = df[target_col].astype(str)
+            numeric_col = pd.api.types.is_numeric_dtype(df[target_col])
+
+            replace_map = {}
+            project_map = {}
+            zayavka_map = {}
+            rule_keys = []
+            for rule in rules:
+                find_keys = [str(rule['find_value'])]
+                if numeric_col:
+                    # В числовой колонке astype(str) дает '5.0' для 5
+                    try:
+                        find_keys.append(str(float(rule['find_value'])))
+                    except (TypeError, ValueError):
+                        pass
+                rule_keys.append(find_keys)
+                for key in find_keys:
+                    replace_map.setdefault(key, rule['replace_value'])
+                    if rule.get('project_value'):
+                        project_map.setdefault(key, rule['project_value'])
+                    if rule.get('project_value2'):
+                        zayavka_map.setdefault(key, rule['project_value2'])
+
+            # Статистика совпадений: один value_counts вместо маски на правило
+            # Журналирование внутри цикла ленивое, только при включенном INFO
+            info_enabled = logger.isEnabledFor(logging.INFO)
+            counts = col_str.value_counts()
+            for rule, find_keys in zip(rules, rule_keys):
+                affected_rows = int(sum(counts.get(key, 0) for key in set(find_keys)))
+                if affected_rows > 0:
+                    if info_enabled:
+                        if rule.get('project_value') and has_project:
+                            logger.info("✅ Установлено значение проекта '%s' для %s строк (значение: %s)", rule['project_value'], affected_rows, rule['find_value'])
+                        if rule.get('project_value2') and has_zayavka:
+                            logger.info("✅ Установлено значение проекта '%s' для %s строк (значение: %s)", rule['project_value2'], affected_rows, rule['find_value'])
+                        logger.info("✅ Правило замены применено: '%s' -> '%s' в колонке '%s' (%s строк)", rule['find_value'], rule['replace_value'], target_col, affected_rows)
+                    rules_applied += 1
+                elif info_enabled:
+                    logger.info("ℹ️ Правило замены не применено: значение '%s' не найдено в колонке '%s'", rule['find_value'], target_col)
+
+            # Все замены колонки применяются одним map по исходным значениям
+            mapped = col_str.map(replace_map)
+            matched = mapped.notna()
+            if matched.any():
+                df[target_col] = mapped.where(matched, df[target_col])
+                if project_map and has_project:
+                    projects = col_str.map(project_map)
+                    df['проект'] = projects.where(projects.notna(), df['проект'])
+                if zayavka_map and has_zayavka:
+                    zayavki = col_str.map(zayavka_map)
+                    df['Заявка'] = zayavki.where(zayavki.notna(), df['Заявка'])
+
+        self.processing_stats['applied_rules'] = rules_applied
+        logger.info(f"Применено правил замены: {rules_applied}")
+    
+    def _create_output_file_v8(self, df, original_filename):
+        """
+        Создание выходного файла с правильным именованием v8.0
+        Запись через write-only workbook: данные пишутся потоково за один
+        проход со стилями, граф стилизованных ячеек не копится в памяти
+        """
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.utils import get_column_letter
+
+        # Генерация имени файла с датой и временем
+        now = datetime.now()
+        timestamp = now.strftime("%Y-%m-%d-%H-%M")
+        output_filename = f"TRANSFORA_dislocation_{timestamp}.xlsx"
+
+        # Получение настроек форматирования из инструкций
+        formatting = self.instructions.get('formatting', {})
+        default_font_name = formatting.get('font_name', 'Calibri')
+        default_font_size = int(formatting.get('font_size', 10))
+        header_bg_color = formatting.get('header_background_color', 'DDDDDD')
+        header_text_color = formatting.get('header_text_color', '000000')
+        cell_bg_color = formatting.get('cell_background_color', 'FFFFFF')
+
+        # Объекты стилей openpyxl неизменяемы: один экземпляр каждого
+        # создается до цикла и переиспользуется для всех ячеек
+        base_font = Font(name=default_font_name, size=default_font_size)
+        header_font = Font(name=default_font_name, size=default_font_size, bold=True, color=header_text_color)
+        header_fill = PatternFill(start_color=header_bg_color, end_color=header_bg_color, fill_type='solid')
+        header_align = Alignment(horizontal='center', vertical='center')
+        center_align = Alignment(vertical='center')
+        # Белая заливка не пишется ни в RGB, ни в ARGB форме
+        if cell_bg_color and cell_bg_color not in ('FFFFFF', 'FFFFFFFF'):
+            cell_fill = PatternFill(start_color=cell_bg_color, end_color=cell_bg_color, fill_type='solid')
+        else:
+            cell_fill = None
+
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet('Дислокация')
+
+        # Ширина колонок считается до записи данных: в write-only режиме
+        # column_dimensions должны быть заданы раньше первой строки
+        # Максимум длин строк считается векторизованно по колонкам,
+        # без python-прохода по каждой ячейке
+        max_widths = [len(str(col)) for col in df.columns]
+        if len(df) > 0:
+            # На больших таблицах ширина оценивается по выборке строк:
+            # автоподбор — визуальная настройка, полный проход по
+            # сотням тысяч строк здесь не оправдан
+            if len(df) > 5000:
+                sample = df.sample(1000, random_state=0)
+            else:
+                sample = df
+            data_widths = sample.astype(str).apply(lambda s: s.str.len().max()).fillna(0)
+            max_widths = [max(h, int(w)) for h, w in zip(max_widths, data_widths)]
+        for i, width in enumerate(max_widths, 1):
+            worksheet.column_dimensions[get_column_letter(i)].width = min(max(width + 2, 10), 50)
+
+        # Заголовки с цветами
+        header_cells = []
+        for col_name in df.columns:
+            cell = WriteOnlyCell(worksheet, value=col_name)
+            cell.font = header_font
+            cell.fill = header_fill
+            cell.alignment = header_align
+            header_cells.append(cell)
+        worksheet.append(header_cells)
+
+        # Данные: стили назначаются прямо при записи, второй проход не нужен
+        # name=None отдает сырые кортежи без аллокации namedtuple на строку
+        for row in df.itertuples(index=False, name=None):
+            cells = []
+            for value in row:
+                # NaN пишем пустой ячейкой, как это делал to_excel
+                if isinstance(value, float) and value != value:
+                    value = None
+                cell = WriteOnlyCell(worksheet, value=value)
+                cell.font = base_font
+                cell.alignment = center_align
+                if cell_fill is not None:
+                    cell.fill = cell_fill
+                cells.append(cell)
+            worksheet.append(cells)
+
+        logger.info(f"✅ Применено форматирование v8.0: шрифт {default_font_name} {default_font_size}pt, цвета из OneDrive")
+
+        # Запись сразу в файл с правильным именем. Каталог уникален для
+        # каждого вызова: метка времени в имени имеет минутное разрешение,
+        # и при параллельной обработке вложений одинаковые пути иначе
+        # затирали бы друг друга
+        output_dir = tempfile.mkdtemp(prefix='transfora_out_')
+        final_output_path = os.path.join(output_dir, output_filename)
+        workbook.save(final_output_path)
+
+        logger.info(f"✅ Файл сохранен с правильным именем: {output_filename}")
+        return final_output_path
+
+    def get_processing_statistics(self):
+        """Получение статистики обработки для email шаблонов v8.1"""
         return self.processing_stats
\ No newline at end of file
@@ -1,69 +1,106 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-"""
-Модуль логирования Excel Mail Processor
-Централизованная система логирования с ротацией файлов
-"""
-
-import logging
-import os
-from logging.handlers import RotatingFileHandler
-from datetime import datetime
-
-def setup_logging():
-    """Настройка системы логирования"""
-
-    # Создаем директорию для логов
-    log_dir = 'logs'
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-
-    # Настройка форматирования
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-
-    # Настройка основного логгера
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-
-    # Очистка существующих обработчиков
-    root_logger.handlers.clear()
-
-    # Консольный обработчик
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
-
-    # Файловый обработчик для всех логов
-    file_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'excel_processor.log'),
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
-
-    # Файловый обработчик только для ошибок
-    error_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'errors.log'),
-        maxBytes=5*1024*1024,  # 5MB
-        backupCount=3,
-        encoding='utf-8'
-    )
-    error_handler.setLevel(logging.ERROR)
-    error_handler.setFormatter(formatter)
-    root_logger.addHandler(error_handler)
-
-def get_logger(name):
-    """Получение логгера для модуля"""
-
-    # Настройка логирования при первом вызове
-    if not logging.getLogger().handlers:
-        setup_logging()
-
-    return logging.getLogger(name)
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Модуль логирования Excel Mail Processor
+Централизованная система логирования с ротацией файлов
+
+Записи ставятся в очередь и пишутся на диск фоновым потоком
+(QueueListener): рабочий поток не блокируется на файловом I/O
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from datetime import datetime
+
+# Ссылка на фоновый слушатель, чтобы он не был собран GC
+_queue_listener = None
+
+# PID процесса, запустившего слушатель: только он останавливает поток
+_listener_pid = None
+
+def setup_logging():
+    """Настройка системы логирования"""
+    global _queue_listener
+
+    # Создаем директорию для логов
+    log_dir = 'logs'
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    # Настройка форматирования
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    # Настройка основного логгера
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+
+    # Очистка существующих обработчиков
+    root_logger.handlers.clear()
+
+    # Консольный обработчик
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(formatter)
+
+    # Файловый обработчик для всех логов
+    file_handler = RotatingFileHandler(
+        os.path.join(log_dir, 'excel_processor.log'),
+        maxBytes=10*1024*1024,  # 10MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+
+    # Файловый обработчик только для ошибок
+    error_handler = RotatingFileHandler(
+        os.path.join(log_dir, 'errors.log'),
+        maxBytes=5*1024*1024,  # 5MB
+        backupCount=3,
+        encoding='utf-8'
+    )
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(formatter)
+
+    # В корневой логгер ставится только QueueHandler: запись в консоль
+    # и файлы выполняет фоновый поток слушателя. Очередь межпроцессная:
+    # рабочие процессы пула наследуют ее при fork, и их записи тоже
+    # стекаются в слушатель родителя, а не теряются
+    global _listener_pid
+    log_queue = multiprocessing.Queue(-1)
+    root_logger.addHandler(QueueHandler(log_queue))
+
+    _queue_listener = QueueListener(
+        log_queue,
+        console_handler,
+        file_handler,
+        error_handler,
+        respect_handler_level=True
+    )
+    _queue_listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(_stop_listener)
+
+def _stop_listener():
+    """Остановка фонового слушателя с дозаписью очереди на диск"""
+    global _queue_listener
+    # В унаследовавших состояние процессах поток слушателя не работает,
+    # останавливать его должен только процесс, который его запустил
+    if _queue_listener is not None and os.getpid() == _listener_pid:
+        _queue_listener.stop()
+        _queue_listener = None
+
+def get_logger(name):
+    """Получение логгера для модуля"""
+
+    # Настройка логирования при первом вызове
+    if not logging.getLogger().handlers:
+        setup_logging()
+
+    return logging.getLogger(name)
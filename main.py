@@ -16,6 +16,7 @@ Excel Mail Processor v8.0 Final
 import sys
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
 # ЗАЩИТА ОТ SEGMENTATION FAULT v8.0
@@ -35,10 +36,9 @@ except:
     pass
 
 # Локальные импорты
-from app_config import Config
-from excel_processor_v8 import ExcelProcessor  # Обновленный модуль v8.0
-from email_handler_v8 import EmailHandler  # Обновленный модуль v8.0
-from onedrive_handler_v8 import OneDriveHandler  # Обновленный модуль v8.0
+# Модули обработки (pandas/openpyxl внутри) импортируются лениво в
+# process_emails/test_system: пути --version/--config стартуют мгновенно
+from app_config import get_config
 from logger import get_logger
 
 # Настройка логирования
@@ -48,8 +48,11 @@ def test_system():
     """Тестирование всех компонентов системы v8.0"""
     print("🔧 Тестирование системы Excel Mail Processor v8.0...")
     try:
+        from email_handler_v8 import EmailHandler
+        from onedrive_handler_v8 import OneDriveHandler
+
         # Загрузка конфигурации
-        config = Config()
+        config = get_config()
         logger.info("✅ Конфигурация загружена успешно")
 
         # Тестирование почтовых соединений
@@ -122,12 +125,23 @@ def test_segfault_protection():
     except Exception as e:
         logger.warning(f"⚠️ Ошибка тестирования защиты: {str(e)}")
 
+def _process_attachment(path, filename, instructions):
+    """Обработка одного вложения в отдельном рабочем процессе"""
+    from excel_processor_v8 import ExcelProcessor
+
+    processor = ExcelProcessor(instructions)
+    output_path = processor.process_file(path, filename)
+    return output_path, processor.get_processing_statistics()
+
 def process_emails():
     """Основная обработка писем v8.0"""
     logger.info("🚀 Запуск обработки писем v8.0")
     try:
+        from email_handler_v8 import EmailHandler
+        from onedrive_handler_v8 import OneDriveHandler
+
         # Загрузка конфигурации
-        config = Config()
+        config = get_config()
         logger.info("📋 Конфигурация загружена")
 
         # Загрузка инструкции с OneDrive v8.0
@@ -141,7 +155,6 @@ def process_emails():
 
         # Инициализация обработчиков v8.0
         email_handler = EmailHandler(config)
-        excel_processor = ExcelProcessor(instructions)
 
         # Проверка новых писем
         logger.info("📧 Проверка новых писем...")
@@ -153,37 +166,63 @@ def process_emails():
 
         logger.info(f"📬 Найдено {len(emails_with_excel)} писем для обработки")
 
-        # Обработка каждого письма
-        processed_files = []
-        for i, email_data in enumerate(emails_with_excel, 1):
-            logger.info(f"⚙️ Обработка письма {i}/{len(emails_with_excel)}")
-
-            # Обработка каждого Excel файла в письме
+        # Сбор всех вложений из всех писем в один список заданий
+        jobs = []
+        for email_data in emails_with_excel:
             for attachment in email_data['attachments']:
-                try:
-                    # Обработка файла v8.0
-                    output_path = excel_processor.process_file(
-                        attachment['content'],
-                        attachment['filename']
-                    )
-
-                    # Получение статистики обработки v8.0
-                    processing_stats = excel_processor.get_processing_statistics()
-
-                    # Отправка результата v8.0 с новыми возможностями
-                    email_handler.send_processed_file_v8(
-                        output_path,
-                        attachment['filename'],
-                        email_data['sender'],
-                        instructions.get('email_template', {}),
-                        processing_stats
-                    )
-
-                    processed_files.append(attachment['filename'])
-                    logger.info(f"✅ Файл {attachment['filename']} обработан и отправлен v8.0")
-
-                except Exception as e:
-                    logger.error(f"❌ Ошибка обработки файла {attachment['filename']}: {str(e)}")
+                jobs.append((attachment, email_data))
+
+        # Параллельная обработка Excel в отдельных процессах v8.0:
+        # BLAS уже ограничен одним потоком на процесс, поэтому файлы не
+        # конкурируют между собой. Отправка результатов остается в
+        # главном процессе (SMTP-соединение с состоянием)
+        processed_files = []
+        max_workers = min(4, os.cpu_count() or 1, len(jobs))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    _process_attachment,
+                    attachment['path'],
+                    attachment['filename'],
+                    instructions
+                ): (attachment, email_data)
+                for attachment, email_data in jobs
+            }
+
+            # Одно SMTP-соединение на весь пакет отправок: TLS-рукопожатие
+            # выполняется один раз, а не на каждый файл
+            email_handler.open_smtp()
+            try:
+                for future in as_completed(futures):
+                    attachment, email_data = futures[future]
+                    try:
+                        # Обработка файла v8.0 выполнена в рабочем процессе
+                        output_path, processing_stats = future.result()
+
+                        # Отправка результата v8.0 с новыми возможностями
+                        email_handler.send_processed_file_v8(
+                            output_path,
+                            attachment['filename'],
+                            email_data['sender'],
+                            instructions.get('email_template', {}),
+                            processing_stats
+                        )
+
+                        processed_files.append(attachment['filename'])
+                        logger.info(f"✅ Файл {attachment['filename']} обработан и отправлен v8.0")
+
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка обработки файла {attachment['filename']}: {str(e)}")
+
+                    finally:
+                        # Удаление временного файла вложения при любом
+                        # исходе, чтобы сбои не копили файлы на диске
+                        try:
+                            os.unlink(attachment['path'])
+                        except OSError:
+                            pass
+            finally:
+                email_handler.close_smtp()
 
         # Пометка писем как прочитанных
         if processed_files:
@@ -218,7 +257,7 @@ def main():
 
     elif args.config:
         try:
-            config = Config()
+            config = get_config()
             print("📋 Текущая конфигурация v8.0:")
             print(f" - IMAP Server: {config.imap_server}:{config.imap_port}")
             print(f" - SMTP Server: {config.smtp_server}:{config.smtp_port}")
@@ -1,360 +1,553 @@
-#!/usr/bin/env python3
-
-# -*- coding: utf-8 -*-
-
-"""
-Модуль работы с OneDrive v8.1
-Загрузка и парсинг файла инструкции
-
-ИСПРАВЛЕНИЯ v8.1:
-- Поддержка параметров обработки дат (is_date, date_format, date_locale)
-- Расширенная валидация настроек дат
-- Обратная совместимость с v8.0
-
-ИСПРАВЛЕНИЯ v8.0:
-- Поддержка листа formatting для цветового оформления
-- Расширенная обработка email шаблонов
-- Валидация структуры и цветов
-"""
-
-import requests
-import tempfile
-import os
-from openpyxl import load_workbook
-from openpyxl.styles import Color
-from logger import get_logger
-
-logger = get_logger(__name__)
-
-class OneDriveHandler:
-    """Обработчик файлов OneDrive v8.1"""
-    
-    def __init__(self, instruction_url):
-        """Инициализация обработчика"""
-        self.instruction_url = instruction_url
-    
-    def get_processing_instructions(self):
-        """Загрузка и парсинг файла инструкции v8.1"""
-        try:
-            logger.info("Загружаем инструкцию с OneDrive...")
-            
-            # Скачивание файла
-            response = requests.get(self.instruction_url, timeout=30)
-            response.raise_for_status()
-            logger.info(f"Файл инструкции загружен, размер: {len(response.content)} байт")
-            
-            # Сохранение во временный файл
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
-                temp_file.write(response.content)
-                temp_file_path = temp_file.name
-            
-            logger.info(f"Парсим файл инструкции: {temp_file_path}")
-            
-            # Парсинг файла v8.1
-            instructions = self._parse_instruction_file_v8_1(temp_file_path)
-            
-            # Удаление временного файла
-            os.unlink(temp_file_path)
-            
-            logger.info("✅ Файл инструкции успешно обработан v8.1")
-            return instructions
-            
-        except Exception as e:
-            logger.error(f"Ошибка при обработке файла инструкции: {str(e)}")
-            return None
-    
-    def _parse_instruction_file_v8_1(self, file_path):
-        """Парсинг Excel файла инструкции v8.1 с поддержкой дат"""
-        try:
-            workbook = load_workbook(file_path, read_only=False)  # read_only=False для доступа к стилям
-            
-            instructions = {
-                'columns': [],
-                'replace_rules': [],
-                'email_template': {},
-                'formatting': {},
-                'variables': []
-            }
-            
-            # Парсинг листа 'columns' v8.1 с поддержкой дат
-            if 'columns' in workbook.sheetnames:
-                logger.info("Найден лист 'columns'")
-                instructions['columns'] = self._parse_columns_sheet_v8_1(workbook['columns'])
-            
-            # Парсинг листа 'replace'
-            if 'replace' in workbook.sheetnames:
-                logger.info("Найден лист 'replace'")
-                instructions['replace_rules'] = self._parse_replace_sheet(workbook['replace'])
-            
-            # Парсинг листа 'email' v8.0 (расширенный)
-            if 'email' in workbook.sheetnames:
-                logger.info("Найден лист 'email'")
-                instructions['email_template'] = self._parse_email_sheet_v8(workbook['email'])
-            
-            # Парсинг листа 'formatting' v8.0 (новый)
-            if 'formatting' in workbook.sheetnames:
-                logger.info("Найден лист 'formatting' v8.0")
-                instructions['formatting'] = self._parse_formatting_sheet_v8(workbook['formatting'])
-            else:
-                logger.info("Лист 'formatting' не найден, используются настройки по умолчанию")
-                instructions['formatting'] = self._get_default_formatting()
-            
-            # Парсинг листа 'instructions' (опционально)
-            if 'instructions' in workbook.sheetnames:
-                logger.info("Найден лист 'instructions'")
-                # Можно добавить парсинг документации при необходимости
-            
-            workbook.close()
-            
-            # Валидация инструкций v8.1
-            self._validate_instructions_v8_1(instructions)
-            
-            return instructions
-            
-        except Exception as e:
-            logger.error(f"Ошибка при парсинге файла инструкции: {str(e)}")
-            return None
-    
-    def _parse_columns_sheet_v8_1(self, sheet):
-        """Парсинг листа 'columns' v8.1 с поддержкой параметров дат"""
-        columns = []
-        
-        # Определяем структуру заголовков
-        headers = []
-        first_row = list(sheet.iter_rows(min_row=1, max_row=1, values_only=True))[0]
-        for i, header in enumerate(first_row):
-            if header:
-                headers.append((i, str(header).lower().strip()))
-        
-        logger.info(f"Найдены заголовки в листе 'columns': {[h[1] for h in headers]}")
-        
-        # Создаем маппинг заголовков
-        header_mapping = {}
-        for i, header in headers:
-            if 'source' in header or header == 'source_name':
-                header_mapping['source_name'] = i
-            elif 'target' in header or header == 'target_name':
-                header_mapping['target_name'] = i
-            elif header == 'action':
-                header_mapping['action'] = i
-            elif header == 'value':
-                header_mapping['value'] = i
-            elif 'date' in header and 'format' in header:
-                header_mapping['date_format'] = i
-            elif header == 'is_date' or ('date' in header and ('is' in header or 'flag' in header)):
-                header_mapping['is_date'] = i
-            elif 'locale' in header or ('date' in header and 'locale' in header):
-                header_mapping['date_locale'] = i
-        
-        logger.info(f"Маппинг заголовков: {header_mapping}")
-        
-        # Парсинг данных
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            if not row or not row[header_mapping.get('source_name', 0)]:
-                continue  # Пропускаем пустые строки
-            
-            column_config = {
-                'source_name': row[header_mapping.get('source_name', 0)],
-                'target_name': row[header_mapping.get('target_name', 1)] if len(row) > 1 and row[header_mapping.get('target_name', 1)] else row[header_mapping.get('source_name', 0)],
-                'action': row[header_mapping.get('action', 2)] if len(row) > 2 and row[header_mapping.get('action', 2)] else 'copy',
-                'value': row[header_mapping.get('value', 3)] if len(row) > 3 and row[header_mapping.get('value', 3)] else None
-            }
-            
-            # Новые параметры для дат v8.1
-            if 'is_date' in header_mapping:
-                is_date_value = row[header_mapping['is_date']] if len(row) > header_mapping['is_date'] else None
-                column_config['is_date'] = self._parse_boolean_value(is_date_value)
-            else:
-                column_config['is_date'] = False
-            
-            if 'date_format' in header_mapping:
-                date_format_value = row[header_mapping['date_format']] if len(row) > header_mapping['date_format'] else None
-                column_config['date_format'] = date_format_value if date_format_value else 'DD.MM.YYYY'
-            else:
-                column_config['date_format'] = 'DD.MM.YYYY'
-            
-            if 'date_locale' in header_mapping:
-                date_locale_value = row[header_mapping['date_locale']] if len(row) > header_mapping['date_locale'] else None
-                column_config['date_locale'] = date_locale_value if date_locale_value else 'ru'
-            else:
-                column_config['date_locale'] = 'ru'
-            
-            columns.append(column_config)
-            
-            # Логирование конфигурации колонок с датами
-            if column_config['is_date']:
-                logger.info(f"✅ Настроена колонка с датами: '{column_config['source_name']}' -> '{column_config['target_name']}' ({column_config['date_format']}, {column_config['date_locale']})")
-        
-        logger.info(f"Загружено столбцов для обработки: {len(columns)}")
-        
-        # Подсчет колонок с датами
-        date_columns = [col for col in columns if col['is_date']]
-        if date_columns:
-            logger.info(f"✅ Найдено {len(date_columns)} колонок с датами")
-        
-        return columns
-    
-    def _parse_boolean_value(self, value):
-        """Парсинг булевых значений из Excel"""
-        if value is None:
-            return False
-        
-        if isinstance(value, bool):
-            return value
-        
-        str_value = str(value).lower().strip()
-        return str_value in ['true', '1', 'да', 'yes', 'y']
-    
-    def _parse_replace_sheet(self, sheet):
-        """Парсинг листа 'replace'"""
-        replace_rules = []
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            if row[0] and row[1] and row[2]:  # Все три колонки должны быть заполнены
-                rule = {
-                    'column': row[0],
-                    'find_value': row[1],
-                    'replace_value': row[2],
-                    'project_value': row[3] if len(row) > 3 and row[3] else None,
-                    'project_value2': row[4] if len(row) > 4 and row[4] else None
-                }
-                replace_rules.append(rule)
-        
-        logger.info(f"Загружено правил замены: {len(replace_rules)}")
-        return replace_rules
-    
-    def _parse_email_sheet_v8(self, sheet):
-        """Парсинг листа 'email' v8.0 с поддержкой расширенных шаблонов"""
-        email_template = {}
-        variables = []
-        
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            if row[0] and row[1]:
-                param_name = row[0]
-                param_value = row[1]
-                
-                # Обработка специальных параметров v8.0
-                if param_name == 'variables':
-                    # Парсинг списка доступных переменных
-                    variables = [var.strip() for var in param_value.split(',')]
-                    email_template['variables'] = variables
-                    logger.info(f"Найдены переменные для email: {variables}")
-                else:
-                    email_template[param_name] = param_value
-        
-        logger.info(f"Загружено настроек email v8.0: {len(email_template)}")
-        
-        # Валидация email шаблона
-        if 'body_template' in email_template:
-            logger.info("✅ Найден полный шаблон body_template v8.0")
-        else:
-            logger.info("ℹ️ Используется совместимый режим email шаблонов v6.0")
-        
-        return email_template
-    
-    def _parse_formatting_sheet_v8(self, sheet):
-        """Парсинг листа 'formatting' v8.0 для цветового оформления"""
-        formatting = {}
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            if row[0] and row[1]:
-                param_name = row[0]
-                param_value = row[1]
-                
-                # Валидация цветовых значений
-                if 'color' in param_name.lower():
-                    param_value = self._validate_color_value(param_value)
-                
-                formatting[param_name] = param_value
-        
-        logger.info(f"Загружено настроек форматирования: {len(formatting)}")
-        
-        # Логирование найденных цветов
-        color_settings = {k: v for k, v in formatting.items() if 'color' in k.lower()}
-        if color_settings:
-            logger.info(f"✅ Цветовые настройки: {color_settings}")
-        
-        return formatting
-    
-    def _validate_color_value(self, color_value):
-        """Валидация и нормализация цветовых значений"""
-        if not color_value:
-            return None
-        
-        # Удаление символа # если есть
-        color_str = str(color_value).replace('#', '').upper()
-        
-        # Проверка длины (должно быть 6 символов для RGB)
-        if len(color_str) == 6:
-            try:
-                # Проверка что это валидный hex
-                int(color_str, 16)
-                return color_str
-            except ValueError:
-                logger.warning(f"Неверный формат цвета: {color_value}, используется значение по умолчанию")
-                return None
-        else:
-            logger.warning(f"Неверная длина цвета: {color_value}, используется значение по умолчанию")
-            return None
-    
-    def _get_default_formatting(self):
-        """Настройки форматирования по умолчанию"""
-        return {
-            'font_name': 'Calibri',
-            'font_size': '10',
-            'header_background_color': 'DDDDDD',
-            'header_text_color': '000000',
-            'cell_background_color': 'FFFFFF'
-        }
-    
-    def _validate_instructions_v8_1(self, instructions):
-        """Валидация структуры инструкций v8.1 с проверкой настроек дат"""
-        required_sections = ['columns', 'replace_rules', 'email_template']
-        
-        for section in required_sections:
-            if section not in instructions:
-                logger.warning(f"⚠️ Отсутствует обязательный раздел: {section}")
-            elif not instructions[section]:
-                logger.warning(f"⚠️ Раздел '{section}' пуст")
-        
-        # Валидация колонок
-        if instructions['columns']:
-            required_columns = [col for col in instructions['columns'] if col['action'] == 'create']
-            logger.info(f"Найдено создаваемых колонок: {len(required_columns)}")
-            
-            # Валидация настроек дат v8.1
-            date_columns = [col for col in instructions['columns'] if col['is_date']]
-            if date_columns:
-                logger.info(f"✅ Найдено колонок с датами: {len(date_columns)}")
-                
-                # Проверка корректности форматов дат
-                valid_formats = ['DD.MM.YYYY', 'DD/MM/YYYY', 'DD-MM-YYYY', 'YYYY-MM-DD', 'MM/DD/YYYY', 'DD MMM YYYY', 'DD MMMM YYYY']
-                for col in date_columns:
-                    if col['date_format'] not in valid_formats:
-                        logger.warning(f"⚠️ Неизвестный формат даты '{col['date_format']}' для колонки '{col['target_name']}'. Поддерживаются: {valid_formats}")
-                    
-                    if col['date_locale'] not in ['ru', 'en']:
-                        logger.warning(f"⚠️ Неизвестная локаль '{col['date_locale']}' для колонки '{col['target_name']}'. Поддерживаются: ru, en")
-        
-        # Валидация правил замены
-        if instructions['replace_rules']:
-            projects = set(rule.get('project_value') for rule in instructions['replace_rules'] if rule.get('project_value'))
-            logger.info(f"Найдено уникальных проектов в правилах: {len(projects)} - {projects}")
-            
-            if instructions['replace_rules']:
-                projects2 = set(rule.get('project_value2') for rule in instructions['replace_rules'] if rule.get('project_value2'))
-                logger.info(f"Найдено уникальных заявок в правилах: {len(projects2)} - {projects2}")
-        
-        # Валидация email шаблона
-        if instructions['email_template']:
-            if 'subject' not in instructions['email_template']:
-                logger.warning("⚠️ Не найден параметр 'subject' в email настройках")
-            
-            # Проверка наличия переменных в шаблоне
-            if 'body_template' in instructions['email_template']:
-                template = instructions['email_template']['body_template']
-                variables_in_template = []
-                for var in ['{source_filename}', '{output_filename}', '{processing_date}', '{processed_rows}']:
-                    if var in template:
-                        variables_in_template.append(var)
-                logger.info(f"Переменные в шаблоне: {variables_in_template}")
-        
+#!/usr/bin/env python3
+
+# -*- coding: utf-8 -*-
+
+"""
+Модуль работы с OneDrive v8.1
+Загрузка и парсинг файла инструкции
+
+ИСПРАВЛЕНИЯ v8.1:
+- Поддержка параметров обработки дат (is_date, date_format, date_locale)
+- Расширенная валидация настроек дат
+- Обратная совместимость с v8.0
+
+ИСПРАВЛЕНИЯ v8.0:
+- Поддержка листа formatting для цветового оформления
+- Расширенная обработка email шаблонов
+- Валидация структуры и цветов
+"""
+
+import io
+import re
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+import requests
+from urllib3.util.retry import Retry
+from openpyxl import load_workbook
+from openpyxl.styles import Color
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# openpyxl сам подхватывает lxml, если тот установлен: его C-парсер
+# заметно быстрее stdlib ElementTree на потоковом чтении read_only
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    logger.warning("⚠️ lxml не установлен — парсинг инструкции будет медленнее")
+
+# Rust-бэкенд чтения xlsx: на порядок быстрее openpyxl по значениям.
+# При отсутствии колеса python-calamine работает откат на openpyxl
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+# Истинные значения булевых параметров инструкции (O(1) проверка по
+# хэшу вместо пересоздаваемого списка на каждый вызов)
+_TRUE_VALUES = frozenset({'true', '1', 'да', 'yes', 'y'})
+
+# Шесть шестнадцатеричных символов RGB-цвета
+_HEX6_RE = re.compile(r'[0-9A-F]{6}')
+
+# Плейсхолдер вида {имя_переменной} в email шаблоне
+_TEMPLATE_VAR_RE = re.compile(r'\{([a-zA-Z_][a-zA-Z0-9_]*)\}')
+
+# Переменные, которые подставляет email_handler при отправке
+_KNOWN_TEMPLATE_VARS = frozenset({
+    'source_filename', 'output_filename', 'processing_date', 'processed_rows'
+})
+
+# Правила классификации заголовков листа 'columns': порядок важен,
+# первый сработавший предикат закрепляет индекс за параметром
+_HEADER_RULES = (
+    ('source_name', lambda h: 'source' in h),
+    ('target_name', lambda h: 'target' in h),
+    ('action', lambda h: h == 'action'),
+    ('value', lambda h: h == 'value'),
+    ('date_format', lambda h: 'date' in h and 'format' in h),
+    ('is_date', lambda h: h == 'is_date' or ('date' in h and ('is' in h or 'flag' in h))),
+    ('date_locale', lambda h: 'locale' in h),
+)
+
+# Кэш разобранных схем листа 'columns': сигнатура строки заголовка ->
+# готовый маппинг имен параметров в индексы колонок
+_SCHEMA_CACHE = {}
+
+@dataclass
+class ColumnConfig:
+    """Конфигурация обработки одной колонки из листа 'columns'"""
+    source_name: str
+    target_name: str
+    action: str = 'copy'
+    value: object = None
+    is_date: bool = False
+    date_format: str = 'DD.MM.YYYY'
+    date_locale: str = 'ru'
+
+class OneDriveHandler:
+    """Обработчик файлов OneDrive v8.1"""
+
+    # Допустимые форматы дат и локали v8.1 (константы класса:
+    # O(1) проверка принадлежности без пересоздания списков)
+    _VALID_DATE_FORMATS = frozenset({
+        'DD.MM.YYYY', 'DD/MM/YYYY', 'DD-MM-YYYY', 'YYYY-MM-DD',
+        'MM/DD/YYYY', 'DD MMM YYYY', 'DD MMMM YYYY'
+    })
+    _VALID_LOCALES = frozenset({'ru', 'en'})
+
+
+    def __init__(self, instruction_url):
+        """Инициализация обработчика"""
+        self.instruction_url = instruction_url
+
+        # Постоянная HTTP-сессия: keep-alive избавляет повторные запросы
+        # от TCP/TLS-рукопожатий, адаптер добавляет пул и ретраи
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(total=3, backoff_factor=0.3)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Кэш разобранных инструкций с валидаторами условного GET:
+        # при неизмененном файле сервер отвечает 304 без тела
+        self._etag = None
+        self._last_modified = None
+        self._cached = None
+
+    def close(self):
+        """Закрытие HTTP-сессии"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def get_processing_instructions(self):
+        """Загрузка и парсинг файла инструкции v8.1"""
+        try:
+            logger.info("Загружаем инструкцию с OneDrive...")
+            
+            # Условный GET: при совпадении валидаторов повторная загрузка
+            # и повторный парсинг xlsx не выполняются вовсе
+            headers = {}
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+
+            # Скачивание файла потоково в память: xlsx инструкции невелик,
+            # openpyxl принимает file-like объект — диск не участвует вовсе
+            response = self.session.get(self.instruction_url, timeout=30, stream=True, headers=headers)
+            try:
+                if response.status_code == 304 and self._cached is not None:
+                    logger.info("✅ Инструкция не изменилась (304), используется кэш")
+                    return self._cached
+                response.raise_for_status()
+
+                buffer = io.BytesIO()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    buffer.write(chunk)
+            finally:
+                response.close()
+
+            logger.info(f"Файл инструкции загружен, размер: {buffer.getbuffer().nbytes} байт")
+
+            logger.info("Парсим файл инструкции...")
+
+            # Парсинг файла v8.1
+            buffer.seek(0)
+            instructions = self._parse_instruction_file_v8_1(buffer)
+
+            # Обновление кэша и валидаторов для следующего запроса
+            if instructions:
+                self._etag = response.headers.get('ETag')
+                self._last_modified = response.headers.get('Last-Modified')
+                self._cached = instructions
+
+            logger.info("✅ Файл инструкции успешно обработан v8.1")
+            return instructions
+
+        # Узкие типизированные обработчики вместо общего except Exception:
+        # неизвестные ошибки всплывают наверх и попадают в мониторинг
+        except requests.Timeout:
+            logger.error(f"⏱ Таймаут при загрузке инструкции: {self.instruction_url[:80]}")
+            return None
+        except requests.ConnectionError as e:
+            logger.error(f"Сетевая ошибка при загрузке инструкции: {str(e)}")
+            return None
+        except requests.HTTPError as e:
+            logger.error(f"HTTP ошибка при загрузке инструкции: {str(e)}")
+            return None
+        except requests.RequestException as e:
+            # Зонтичный обработчик для остальных ошибок requests —
+            # например, ChunkedEncodingError при обрыве потока скачивания
+            logger.error(f"Ошибка запроса при загрузке инструкции: {str(e)}")
+            return None
+        except zipfile.BadZipFile:
+            logger.error("Файл инструкции поврежден или не является xlsx")
+            return None
+    
+    def _load_sheet_rows(self, source):
+        """
+        Чтение всех листов книги в словарь {имя: список строк-кортежей}
+        Основной путь — calamine (Rust), откат — openpyxl read_only
+        """
+        if CalamineWorkbook is not None:
+            try:
+                if hasattr(source, 'read'):
+                    source.seek(0)
+                    workbook = CalamineWorkbook.from_filelike(source)
+                else:
+                    workbook = CalamineWorkbook.from_path(source)
+                return {
+                    name: [tuple(row) for row in workbook.get_sheet_by_name(name).to_python()]
+                    for name in workbook.sheet_names
+                }
+            except Exception as e:
+                logger.warning(f"⚠️ calamine не смог прочитать файл ({e}), используется openpyxl")
+                if hasattr(source, 'seek'):
+                    source.seek(0)
+
+        # Парсеры листов читают только значения ячеек, стили не нужны:
+        # read_only превращает загрузку DOM в потоковое SAX-чтение
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        # Книга закрывается при любом исходе чтения: незакрытый
+        # zip-дескриптор утекал бы при ошибке на одном из листов
+        try:
+            return {
+                worksheet.title: list(worksheet.iter_rows(values_only=True))
+                for worksheet in workbook.worksheets
+            }
+        finally:
+            workbook.close()
+
+    def _parse_instruction_file_v8_1(self, source):
+        """
+        Парсинг Excel файла инструкции v8.1 с поддержкой дат
+        Принимает путь к файлу или file-like объект (BytesIO)
+        """
+        try:
+            sheets = self._load_sheet_rows(source)
+
+            instructions = {
+                'columns': [],
+                'replace_rules': [],
+                'email_template': {},
+                'formatting': {},
+                'variables': []
+            }
+
+            # Парсинг листа 'columns' v8.1 с поддержкой дат
+            if 'columns' in sheets:
+                logger.info("Найден лист 'columns'")
+                instructions['columns'] = self._parse_columns_sheet_v8_1(sheets['columns'])
+
+            # Парсинг листа 'replace'
+            if 'replace' in sheets:
+                logger.info("Найден лист 'replace'")
+                instructions['replace_rules'] = self._parse_replace_sheet(sheets['replace'])
+
+            # Парсинг листа 'email' v8.0 (расширенный)
+            if 'email' in sheets:
+                logger.info("Найден лист 'email'")
+                instructions['email_template'] = self._parse_email_sheet_v8(sheets['email'])
+
+            # Парсинг листа 'formatting' v8.0 (новый)
+            if 'formatting' in sheets:
+                logger.info("Найден лист 'formatting' v8.0")
+                instructions['formatting'] = self._parse_formatting_sheet_v8(sheets['formatting'])
+            else:
+                logger.info("Лист 'formatting' не найден, используются настройки по умолчанию")
+                instructions['formatting'] = self._get_default_formatting()
+
+            # Парсинг листа 'instructions' (опционально)
+            if 'instructions' in sheets:
+                logger.info("Найден лист 'instructions'")
+                # Можно добавить парсинг документации при необходимости
+
+
+            # Валидация инструкций v8.1
+            self._validate_instructions_v8_1(instructions)
+            
+            return instructions
+
+        # Поврежденный zip всплывает выше; здесь ловятся только ошибки
+        # структуры данных самого файла инструкции
+        except (KeyError, ValueError, TypeError) as e:
+            logger.error(f"Ошибка при парсинге файла инструкции: {str(e)}")
+            return None
+    
+    def _parse_columns_sheet_v8_1(self, sheet_rows):
+        """Парсинг листа 'columns' v8.1 с поддержкой параметров дат"""
+        columns = []
+
+        # Один проход по строкам листа: заголовок снимается с того же
+        # итератора, по которому дальше читаются данные
+        rows = iter(sheet_rows)
+        first_row = next(rows, ())
+
+        # Схема заголовков в продакшене фиксирована: разобранный маппинг
+        # кэшируется по сигнатуре строки заголовка, повторные файлы с той
+        # же шапкой минуют классификацию заголовков целиком
+        header_key = tuple(first_row)
+        header_mapping = _SCHEMA_CACHE.get(header_key)
+        if header_mapping is None:
+            # Определяем структуру заголовков
+            headers = []
+            for i, header in enumerate(first_row):
+                if header:
+                    headers.append((i, str(header).lower().strip()))
+
+            logger.info(f"Найдены заголовки в листе 'columns': {[h[1] for h in headers]}")
+
+            # Создаем маппинг заголовков по декларативной таблице правил
+            header_mapping = {}
+            for i, header in headers:
+                for key, predicate in _HEADER_RULES:
+                    if key not in header_mapping and predicate(header):
+                        header_mapping[key] = i
+                        break
+
+            logger.info(f"Маппинг заголовков: {header_mapping}")
+            _SCHEMA_CACHE[header_key] = header_mapping
+
+
+        # Индексы колонок снимаются в локальные переменные до цикла:
+        # в самом цикле не остается словарных выборок на каждую строку
+        src_i = header_mapping.get('source_name', 0)
+        tgt_i = header_mapping.get('target_name', 1)
+        act_i = header_mapping.get('action', 2)
+        val_i = header_mapping.get('value', 3)
+        is_date_i = header_mapping.get('is_date')
+        fmt_i = header_mapping.get('date_format')
+        loc_i = header_mapping.get('date_locale')
+
+        # Парсинг данных (продолжение того же генератора строк)
+        for row in rows:
+            # Полностью пустые хвостовые строки, которые openpyxl отдает
+            # по max_row, отбрасываются до любой обработки
+            if row is None or not any(row):
+                continue
+            n = len(row)
+            if n <= src_i or not row[src_i]:
+                continue  # Пропускаем пустые строки
+
+            source_name = row[src_i]
+            column_config = ColumnConfig(
+                source_name=source_name,
+                target_name=row[tgt_i] if n > tgt_i and row[tgt_i] else source_name,
+                action=row[act_i] if n > act_i and row[act_i] else 'copy',
+                value=row[val_i] if n > val_i and row[val_i] else None,
+                # Новые параметры для дат v8.1
+                is_date=self._parse_boolean_value(row[is_date_i]) if is_date_i is not None and n > is_date_i else False,
+                date_format=row[fmt_i] if fmt_i is not None and n > fmt_i and row[fmt_i] else 'DD.MM.YYYY',
+                date_locale=row[loc_i] if loc_i is not None and n > loc_i and row[loc_i] else 'ru'
+            )
+
+            columns.append(column_config)
+
+            # Логирование конфигурации колонок с датами
+            if column_config.is_date:
+                logger.info(f"✅ Настроена колонка с датами: '{column_config.source_name}' -> '{column_config.target_name}' ({column_config.date_format}, {column_config.date_locale})")
+
+        logger.info(f"Загружено столбцов для обработки: {len(columns)}")
+
+        # Подсчет колонок с датами
+        date_columns = [col for col in columns if col.is_date]
+        if date_columns:
+            logger.info(f"✅ Найдено {len(date_columns)} колонок с датами")
+        
+        return columns
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _parse_boolean_value(value):
+        """Парсинг булевых значений из Excel (мемоизированный)"""
+        if value is None:
+            return False
+
+        if isinstance(value, bool):
+            return value
+
+        return str(value).lower().strip() in _TRUE_VALUES
+    
+    def _parse_replace_sheet(self, sheet_rows):
+        """Парсинг листа 'replace'"""
+        replace_rules = []
+        rows = iter(sheet_rows)
+        next(rows, None)  # Пропуск строки заголовка
+        for row in rows:
+            if row is None or not any(row):
+                continue  # Пропускаем полностью пустые строки
+            # Дополнение до пяти значений и распаковка одним кортежем
+            # вместо цепочки row[i] с проверками длины
+            column, find_value, replace_value, project_value, project_value2 = (row + (None,) * 5)[:5]
+            if column and find_value and replace_value:  # Все три колонки должны быть заполнены
+                replace_rules.append({
+                    'column': column,
+                    'find_value': find_value,
+                    'replace_value': replace_value,
+                    'project_value': project_value if project_value else None,
+                    'project_value2': project_value2 if project_value2 else None
+                })
+        
+        logger.info(f"Загружено правил замены: {len(replace_rules)}")
+        return replace_rules
+    
+    def _parse_email_sheet_v8(self, sheet_rows):
+        """Парсинг листа 'email' v8.0 с поддержкой расширенных шаблонов"""
+        email_template = {}
+        variables = []
+
+        rows = iter(sheet_rows)
+        next(rows, None)  # Пропуск строки заголовка
+        for row in rows:
+            if row is None or not any(row):
+                continue  # Пропускаем полностью пустые строки
+            if len(row) > 1 and row[0] and row[1]:
+                param_name = row[0]
+                param_value = row[1]
+
+                # Обработка специальных параметров v8.0
+                if param_name == 'variables':
+                    # Парсинг списка доступных переменных
+                    variables = [var.strip() for var in param_value.split(',')]
+                    email_template['variables'] = variables
+                    logger.info(f"Найдены переменные для email: {variables}")
+                else:
+                    email_template[param_name] = param_value
+        
+        logger.info(f"Загружено настроек email v8.0: {len(email_template)}")
+        
+        # Валидация email шаблона
+        if 'body_template' in email_template:
+            logger.info("✅ Найден полный шаблон body_template v8.0")
+        else:
+            logger.info("ℹ️ Используется совместимый режим email шаблонов v6.0")
+        
+        return email_template
+    
+    def _parse_formatting_sheet_v8(self, sheet_rows):
+        """Парсинг листа 'formatting' v8.0 для цветового оформления"""
+        formatting = {}
+        rows = iter(sheet_rows)
+        next(rows, None)  # Пропуск строки заголовка
+        for row in rows:
+            if row is None or not any(row):
+                continue  # Пропускаем полностью пустые строки
+            if len(row) > 1 and row[0] and row[1]:
+                param_name = row[0]
+                param_value = row[1]
+
+                # Валидация цветовых значений
+                if 'color' in param_name.lower():
+                    param_value = self._validate_color_value(param_value)
+                
+                formatting[param_name] = param_value
+        
+        logger.info(f"Загружено настроек форматирования: {len(formatting)}")
+        
+        # Логирование найденных цветов
+        color_settings = {k: v for k, v in formatting.items() if 'color' in k.lower()}
+        if color_settings:
+            logger.info(f"✅ Цветовые настройки: {color_settings}")
+        
+        return formatting
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _validate_color_value(color_value):
+        """Валидация и нормализация цветовых значений (мемоизированная)"""
+        if not color_value:
+            return None
+
+        # Удаление символа # если есть
+        color_str = str(color_value).lstrip('#').upper()
+
+        # fullmatch по предкомпилированному шаблону вместо int(x, 16)
+        # в try/except: невалидные значения не платят за исключение
+        if _HEX6_RE.fullmatch(color_str):
+            # Полная ARGB-форма, чтобы openpyxl не терял альфа-канал
+            return 'FF' + color_str
+
+        logger.warning(f"Неверный формат цвета: {color_value}, используется значение по умолчанию")
+        return None
+    
+    def _get_default_formatting(self):
+        """Настройки форматирования по умолчанию"""
+        return {
+            'font_name': 'Calibri',
+            'font_size': '10',
+            'header_background_color': 'DDDDDD',
+            'header_text_color': '000000',
+            'cell_background_color': 'FFFFFF'
+        }
+    
+    def _validate_instructions_v8_1(self, instructions):
+        """Валидация структуры инструкций v8.1 с проверкой настроек дат"""
+        required_sections = ['columns', 'replace_rules', 'email_template']
+        
+        for section in required_sections:
+            if section not in instructions:
+                logger.warning(f"⚠️ Отсутствует обязательный раздел: {section}")
+            elif not instructions[section]:
+                logger.warning(f"⚠️ Раздел '{section}' пуст")
+        
+        # Валидация колонок
+        if instructions['columns']:
+            required_columns = [col for col in instructions['columns'] if col.action == 'create']
+            logger.info(f"Найдено создаваемых колонок: {len(required_columns)}")
+
+            # Валидация настроек дат v8.1
+            date_columns = [col for col in instructions['columns'] if col.is_date]
+            if date_columns:
+                logger.info(f"✅ Найдено колонок с датами: {len(date_columns)}")
+
+                # Проверка корректности форматов дат
+                for col in date_columns:
+                    if col.date_format not in self._VALID_DATE_FORMATS:
+                        logger.warning(f"⚠️ Неизвестный формат даты '{col.date_format}' для колонки '{col.target_name}'. Поддерживаются: {sorted(self._VALID_DATE_FORMATS)}")
+
+                    if col.date_locale not in self._VALID_LOCALES:
+                        logger.warning(f"⚠️ Неизвестная локаль '{col.date_locale}' для колонки '{col.target_name}'. Поддерживаются: ru, en")
+        
+        # Валидация правил замены: оба множества собираются одним проходом
+        if instructions['replace_rules']:
+            projects = set()
+            projects2 = set()
+            for rule in instructions['replace_rules']:
+                project_value = rule.get('project_value')
+                if project_value:
+                    projects.add(project_value)
+                project_value2 = rule.get('project_value2')
+                if project_value2:
+                    projects2.add(project_value2)
+
+            logger.info(f"Найдено уникальных проектов в правилах: {len(projects)} - {projects}")
+            logger.info(f"Найдено уникальных заявок в правилах: {len(projects2)} - {projects2}")
+        
+        # Валидация email шаблона
+        if instructions['email_template']:
+            if 'subject' not in instructions['email_template']:
+                logger.warning("⚠️ Не найден параметр 'subject' в email настройках")
+            
+            # Проверка наличия переменных в шаблоне: все плейсхолдеры
+            # извлекаются одним проходом регулярного выражения
+            if 'body_template' in instructions['email_template']:
+                template = instructions['email_template']['body_template']
+                found_vars = set(_TEMPLATE_VAR_RE.findall(template))
+                variables_in_template = sorted(found_vars & _KNOWN_TEMPLATE_VARS)
+                logger.info(f"Переменные в шаблоне: {variables_in_template}")
+                unknown_vars = found_vars - _KNOWN_TEMPLATE_VARS
+                if unknown_vars:
+                    logger.warning(f"⚠️ Неизвестные переменные в шаблоне: {sorted(unknown_vars)}")
+        
         logger.info("✅ Валидация инструкций v8.1 завершена")
\ No newline at end of file